@@ -1,24 +1,45 @@
 import logging
+from asyncio import sleep
 from traceback import format_exc
 
 from discord import Channel, Forbidden, Game, Object
 from discord.ext.commands import Bot, CommandNotFound, Context
 from websockets.exceptions import ConnectionClosed
 
+from bot.dispatcher import CommandDispatcher
 from bot.error_handler import command_error_handler, format_command_error, \
     format_traceback
-from bot.logger import command_formatter
+from bot.logger import command_formatter, format_counters
 from bot.session_manager import SessionManager
 from core.help import get_help
+from core.image_generator import PREFETCH_CONCURRENCY, image_store, \
+    prefetch_card_images, reload_sprite_atlas
+from core.sprite_atlas import RELOAD_INTERVAL
+from core.tracing import span, tracer
 from data_controller.mongo import MongoClient
 from core import argument_parser
 
+# Seconds between checks for newly inserted cards.
+CATALOG_REFRESH_INTERVAL = 120
+
+# Seconds between refreshes of the bot stats.
+STATS_REFRESH_INTERVAL = 300
+
+# Seconds between checks for prefixes changed by other shards.
+PREFIX_SYNC_INTERVAL = 60
+
+# Seconds between rebuilds of the leaderboards from user stats.
+LEADERBOARD_RECONCILE_INTERVAL = 60 * 60
+
+# Seconds between logs of command stage percentiles and counters.
+REPORT_INTERVAL = 10 * 60
+
 
 class HahaNoUR(Bot):
     def __init__(self, prefix: str, start_time: int, colour: int, logger,
                  session_manager: SessionManager, db: MongoClient,
                  error_log: int, feedback_log: int, shard_id: int,
-                 shard_count: int):
+                 shard_count: int, config: dict = None):
         """
         Init the instance of HahaNoUR.
         :param prefix: the bot prefix.
@@ -28,6 +49,7 @@ class HahaNoUR(Bot):
         :param session_manager: the SessionManager instance.
         :param db: the MongoDB data controller.
         :param error_log: the channel id for error log.
+        :param config: the bot configuration.
         """
         super().__init__(prefix, shard_id=shard_id, shard_count=shard_count)
         self.prefix = prefix
@@ -39,6 +61,10 @@ class HahaNoUR(Bot):
         self.db = db
         self.idol_names = []
         self.session_manager = session_manager
+        self.config = config or {}
+        self.counters = {}
+        self.dispatcher = CommandDispatcher(self, prefix)
+        self.__warmed_up = False
         # FIXME remove type casting after library rewrite
         self.error_log = Object(str(error_log))
         self.feedbag_log = Object(str(feedback_log))
@@ -51,6 +77,14 @@ class HahaNoUR(Bot):
         """
         for cog in cogs:
             self.add_cog(cog)
+        self.dispatcher.rebuild()
+        self.loop.create_task(self.__report_stats())
+        self.loop.create_task(self.__reload_sprite_atlas())
+        if self.db:
+            self.loop.create_task(self.__refresh_catalog())
+            self.loop.create_task(self.__refresh_stats())
+            self.loop.create_task(self.__reconcile_leaderboards())
+            self.loop.create_task(self.__sync_prefixes())
         self.run(token)
 
     async def __change_presence(self):
@@ -66,6 +100,148 @@ class HahaNoUR(Bot):
             await self.login()
             await self.__change_presence()
 
+    async def __refresh_catalog(self):
+        """
+        Periodically add newly inserted cards to the card catalog.
+        """
+        await self.wait_until_ready()
+        while not self.is_closed:
+            await sleep(CATALOG_REFRESH_INTERVAL)
+            try:
+                await self.update_catalog()
+            except Exception:
+                self.logger.log(logging.WARN, format_exc())
+
+    async def __refresh_stats(self):
+        """
+        Periodically share this shard's counts and refresh the bot stats.
+        """
+        await self.wait_until_ready()
+        while not self.is_closed:
+            try:
+                await self.db.stats.refresh(
+                    self.shard_id or 0, len(self.servers),
+                    len(self.db.cards.catalog)
+                )
+            except Exception:
+                self.logger.log(logging.WARN, format_exc())
+            await sleep(STATS_REFRESH_INTERVAL)
+
+    async def __sync_prefixes(self):
+        """
+        Periodically pick up prefixes changed by other shards.
+        """
+        await self.wait_until_ready()
+        while not self.is_closed:
+            await sleep(PREFIX_SYNC_INTERVAL)
+            try:
+                await self.db.servers.sync_prefixes()
+            except Exception:
+                self.logger.log(logging.WARN, format_exc())
+
+    async def __reconcile_leaderboards(self):
+        """
+        Periodically rebuild the leaderboards of the servers this shard owns,
+        and the global leaderboards on the first shard.
+        """
+        await self.wait_until_ready()
+        while not self.is_closed:
+            try:
+                if not self.shard_id:
+                    await self.db.leaderboards.reconcile_global()
+                await self.db.leaderboards.reconcile_servers({
+                    server.id: [member.id for member in server.members]
+                    for server in list(self.servers)
+                })
+            except Exception:
+                self.logger.log(logging.WARN, format_exc())
+            await sleep(LEADERBOARD_RECONCILE_INTERVAL)
+
+    async def __reload_sprite_atlas(self):
+        """
+        Periodically check for a rebuilt sprite atlas.
+        """
+        while not self.is_closed:
+            try:
+                await reload_sprite_atlas()
+            except Exception:
+                self.logger.log(logging.WARN, format_exc())
+            await sleep(RELOAD_INTERVAL)
+
+    def add_counters(self, name: str, get_counters):
+        """
+        Add counters to the periodic report.
+        :param name: name of what is counted.
+        :param get_counters: function returning a dictionary of counters.
+        """
+        self.counters[name] = get_counters
+
+    async def __report_stats(self):
+        """
+        Periodically log the stage percentiles of commands and the counters.
+        """
+        await self.wait_until_ready()
+        while not self.is_closed:
+            await sleep(REPORT_INTERVAL)
+            report = tracer.report()
+            if report:
+                self.logger.log(
+                    logging.INFO, 'Command stages\n' + '\n'.join(report))
+            for name, get_counters in self.counters.items():
+                try:
+                    self.logger.log(logging.INFO, format_counters(
+                        name, get_counters()))
+                except Exception:
+                    self.logger.log(logging.WARN, format_exc())
+
+    async def update_catalog(self):
+        """
+        Add newly inserted cards to the card catalog and prefetch their
+        images.
+        """
+        added = await self.db.cards.refresh_catalog()
+        if not added:
+            return
+        self.logger.log(logging.INFO, f'{len(added)} cards added to catalog')
+        self.idol_names = self.db.cards.catalog.idol_names()
+        if self.config.get('prefetch_images', True):
+            await self.__prefetch_images(added)
+
+    async def __prefetch_images(self, cards: list):
+        """
+        Download the images of cards ahead of the first scout. Shards share
+            the image store, so only the first shard downloads them.
+        :param cards: the cards.
+        """
+        if self.shard_id:
+            return
+        count = await prefetch_card_images(
+            self.session_manager, cards,
+            self.config.get('prefetch_concurrency', PREFETCH_CONCURRENCY)
+        )
+        self.logger.log(logging.INFO, f'{count} card images prefetched')
+
+    def record_leaderboards(self, ctx):
+        """
+        Moves the author of a command to their place on the leaderboards
+            after their album changed, in the background.
+        :param ctx: the context.
+        """
+        server_id = ctx.message.server.id if ctx.message.server else None
+        self.loop.create_task(
+            self.__record_leaderboards(ctx.message.author.id, server_id))
+
+    async def __record_leaderboards(self, user_id: str, server_id: str):
+        """
+        Moves a user to their place on the leaderboards.
+        :param user_id: the user's ID.
+        :param server_id: the server's ID or None for direct messages.
+        """
+        try:
+            await self.db.leaderboards.record_user(user_id, server_id)
+        except Exception:
+            self.logger.log(logging.WARN, format_exc())
+
     async def send_traceback(self, tb, header):
         """
         Send traceback to the error log channel.
@@ -76,6 +252,24 @@ class HahaNoUR(Bot):
         for s in format_traceback(tb):
             await self.send_message(self.error_log, s)
 
+    async def upload(self, *args, **kwargs):
+        """
+        Overwrites the upload method to trace uploads as a command stage.
+        """
+        with span('upload'):
+            return await super().upload(*args, **kwargs)
+
+    async def close(self):
+        """
+        Overwrites the close method to save the image store index, which is
+            otherwise saved periodically.
+        """
+        try:
+            image_store.save_index()
+        except Exception:
+            self.logger.log(logging.WARN, format_exc())
+        await super().close()
+
     async def on_ready(self):
         """
         Event for when the bot is ready.
@@ -83,41 +277,43 @@ class HahaNoUR(Bot):
         self.logger.log(logging.INFO, 'Logged in')
         self.logger.log(logging.INFO, f'{len(self.servers)} servers detected')
         self.help_general, self.all_help = get_help(self)
-        self.idol_names = await self.db.cards.get_idol_names()
+        await self.db.users.create_indexes()
+        await self.db.states.create_indexes()
+        await self.db.leaderboards.create_indexes()
+        await self.db.servers.create_indexes()
+        await self.db.servers.load_prefixes(
+            [server.id for server in self.servers])
+        await self.db.cards.load_catalog()
+        self.logger.log(
+            logging.INFO, f'{len(self.db.cards.catalog)} cards loaded')
+        self.idol_names = self.db.cards.catalog.idol_names()
+        if self.config.get('prefetch_on_startup') and not self.__warmed_up:
+            self.__warmed_up = True
+            self.loop.create_task(
+                self.__prefetch_images(self.db.cards.catalog.cards()))
         await self.__change_presence()
 
     async def process_commands(self, message):
         """
-        Overwrites the process_commands method to ignore bot users and
-        log commands.
+        Overwrites the process_commands method to ignore bot users, use
+        custom prefixes and log commands.
         """
-        if message.author.bot or len(message.content) < 1:
-            return
-        
         content = message.content
-        if not content:
+        if not content or message.author.bot:
             return
-    
-        # Look up any custom prefixes and replace them with the bot prefix.
+
+        prefix = self.prefix
         if message.server:
-            custom_prefix = await self.db.servers.get_prefix(message.server.id)
-            if content.startswith(custom_prefix):
-                content = self.prefix + content[len(custom_prefix):]
-            elif content.startswith(self.prefix) and self.prefix != custom_prefix:
-                content = content[1:]
-
-        # Pull alarm in case of emergency.
-        if content.split(' ')[0].startswith('resetprefix'):
-            content = self.prefix + 'resetprefix'
-
-        is_cmd = (content[0] == self.prefix)
-        command_name = content.split(' ')[0][len(self.prefix):]
-        if is_cmd and command_name in list(self.commands.keys()):
-            log_entry = command_formatter(message, self.prefix + command_name)
-            self.logger.log(logging.INFO, log_entry)
-            
-        message.content = content
-        await super().process_commands(message)
+            prefix = await self.db.servers.get_prefix(message.server.id)
+
+        match = self.dispatcher.match(content, prefix)
+        if match is None:
+            return
+
+        _, start, end = match
+        log_entry = command_formatter(message, self.prefix + content[start:end])
+        self.logger.log(logging.INFO, log_entry)
+        await self.dispatcher.invoke(message, match)
 
     async def on_error(self, event_method, *args, **kwargs):
         """
@@ -0,0 +1,100 @@
+import re
+
+from discord.ext.commands import CommandError, Context
+from discord.ext.commands.view import StringView
+
+from core.tracing import tracer
+
+# Command recognised without a prefix, in case a server sets one nobody can
+# type.
+EMERGENCY_COMMAND = 'resetprefix'
+
+# Matches the command name that follows a prefix.
+INVOKER_PATTERN = re.compile(r'\S*')
+
+
+class CommandDispatcher:
+    """
+    Finds and invokes the command a message calls. Messages that are not
+        commands are rejected by a prefix check, without splitting them.
+    """
+
+    def __init__(self, bot, prefix: str):
+        """
+        Constructor for a CommandDispatcher.
+
+        :param bot: the bot whose commands are dispatched.
+        :param prefix: the bot prefix, which commands are logged and
+            invoked with.
+        """
+        self.bot = bot
+        self.prefix = prefix
+        self.commands = {}
+
+    def rebuild(self):
+        """
+        Rebuilds the map of command names and aliases to commands, must be
+            called after commands were added or removed.
+        """
+        self.commands = dict(self.bot.commands)
+
+    def match(self, content: str, prefix: str):
+        """
+        Finds the command a message invokes.
+
+        :param content: content of the message.
+        :param prefix: the prefix of the server the message was sent in.
+
+        :return: Tuple of (command, index the command name starts at, index
+            it ends at) or None if the message does not invoke a command.
+        """
+        if content.startswith(prefix):
+            start = len(prefix)
+            end = INVOKER_PATTERN.match(content, start).end()
+            if start == end:
+                return None
+            command = self.commands.get(content[start:end])
+            return (command, start, end) if command else None
+
+        # Pull alarm in case of emergency. The bot prefix is ignored in
+        # servers with a custom prefix.
+        start = len(self.prefix) if content.startswith(self.prefix) else 0
+        if not content.startswith(EMERGENCY_COMMAND, start):
+            return None
+        command = self.commands.get(EMERGENCY_COMMAND)
+        if not command:
+            return None
+        return command, start, start + len(EMERGENCY_COMMAND)
+
+    async def invoke(self, message, match: tuple):
+        """
+        Invokes a command and traces it. Mirrors Bot.process_commands, but
+            starts reading arguments after the command name that was already
+            matched.
+
+        :param message: the message invoking the command.
+        :param match: the result of match for the message.
+        """
+        command, start, end = match
+        content = message.content
+        # Commands read the content with the bot prefix.
+        if start != len(self.prefix) or not content.startswith(self.prefix):
+            content = self.prefix + content[start:]
+            message.content = content
+        view = StringView(content)
+        view.previous = len(self.prefix)
+        view.index = len(self.prefix) + end - start
+
+        bot = self.bot
+        ctx = Context(
+            bot=bot, invoked_with=content[view.previous:view.index],
+            message=message, view=view, prefix=self.prefix
+        )
+        bot.dispatch('command', command, ctx)
+        with tracer.trace(command.name):
+            try:
+                await command.invoke(ctx)
+            except CommandError as e:
+                ctx.command.dispatch_error(e, ctx)
+            else:
+                bot.dispatch('command_completion', command, ctx)
@@ -26,6 +26,18 @@ def command_formatter(message: Message, command_name=None) -> str:
     return f'{command} from {message.author} ({message.author.id}) {server}'
 
 
+def format_counters(name: str, counters: dict) -> str:
+    """
+    Format counters into a message to be logged.
+
+    :param name: name of what is counted.
+    :param counters: dictionary mapping counter names to values.
+    :return: the formatted log message.
+    """
+    values = ' '.join(f'{key}={value}' for key, value in counters.items())
+    return f'{name}: {values}'
+
+
 def timestamp(*args):
     """
     Gets the current timestamp
@@ -1,16 +1,49 @@
-from itertools import chain
+"""
+Cleans up cached files.
+
+    python clean_cache.py logs
+        Deletes all log files.
+    python clean_cache.py images [max_bytes]
+        Evicts the least recently used idol images until the image store is
+        no larger than max_bytes (default: half of its budget). Images in use
+        stay cached, so shards do not all download them again.
+"""
+import sys
+from json import load
 from pathlib import Path
 
+from config import config_path
+from core.image_store import ImageStore
 from idol_images import idol_img_path
 from logs import log_path
 
+# Default size budget of the image store, matches core.image_generator.
+IMAGE_STORE_BYTES = 4 * 1024 * 1024 * 1024
+
 
-def clean():
-    for _path in chain(log_path.iterdir(), idol_img_path.iterdir()):
+def clean_logs():
+    for _path in log_path.iterdir():
         path = Path(_path)
         if not path.name.endswith('.py') and not path.is_dir():
             path.unlink()
 
 
+def clean_images(max_bytes: int = None):
+    with config_path.joinpath('config.json').open() as f:
+        config = load(f)
+    store = ImageStore(
+        idol_img_path, config.get('image_store_bytes', IMAGE_STORE_BYTES))
+    store.load()
+    if max_bytes is None:
+        max_bytes = store.max_bytes // 2
+    store.evict(max_bytes)
+    print(f'Image store is now {store.bytes} bytes')
+
+
 if __name__ == '__main__':
-    clean()
+    if len(sys.argv) > 1 and sys.argv[1] == 'logs':
+        clean_logs()
+    elif len(sys.argv) > 1 and sys.argv[1] == 'images':
+        clean_images(int(sys.argv[2]) if len(sys.argv) > 2 else None)
+    else:
+        print(__doc__)
@@ -3,5 +3,6 @@ from commands.album_commands import Album
 from commands.scout_commands import Scout
 from commands.stats_commands import Stats
 from commands.config_commands import Config
+from commands.leaderboard_commands import Leaderboard
 
-__all__ = ['Scout', 'Album', 'Info', 'Stats', 'Config']
+__all__ = ['Scout', 'Album', 'Info', 'Stats', 'Config', 'Leaderboard']
@@ -1,8 +1,7 @@
 import math
+from io import BytesIO
+from itertools import islice
 from operator import itemgetter
-from posixpath import basename
-from urllib.parse import urlsplit
-from copy import deepcopy
 
 from discord import User
 from discord.ext import commands
@@ -10,7 +9,11 @@ from discord.ext import commands
 from bot import HahaNoUR
 from core.argument_parser import parse_arguments
 from core.checks import check_mongo
-from core.image_generator import create_image, get_one_img, idol_img_path
+from core.image_generator import create_image, get_one_img, \
+    image_extension
+from core.lru_cache import LRUCache
+from core.state_store import MemoryStateStore
+from core.tracing import span
 
 PAGE_SIZE = 16
 ROWS = 4
@@ -26,8 +29,40 @@ SORTS = [
     'newest'
 ]
 
-# Dictionary mapping user ids to last used album arguments
-_last_user_args = {}
+# Default number of seconds a user's album arguments are remembered for.
+ALBUM_STATE_TTL = 30 * 60
+# Default memory budget for remembered album arguments, in bytes.
+ALBUM_STATE_BYTES = 4 * 1024 * 1024
+
+# Store of the last used album arguments of each user.
+album_state = MemoryStateStore(ALBUM_STATE_TTL, ALBUM_STATE_BYTES)
+
+# Default memory budget for rendered album pages, in bytes.
+ALBUM_PAGE_CACHE_BYTES = 32 * 1024 * 1024
+
+# Rendered album pages keyed by user id, album version, filters, sort and
+# requested page. Values are (image bytes, filtered album size, shown page).
+album_page_cache = LRUCache(ALBUM_PAGE_CACHE_BYTES, lambda page: len(page[0]))
+
+
+def configure_album_state(store):
+    """
+    Replaces the store of users' last used album arguments.
+
+    :param store: A MemoryStateStore or another store with the same
+        interface, such as data_controller's StateController.
+    """
+    global album_state
+    album_state = store
+
+
+def configure_album_page_cache(max_bytes: int):
+    """
+    Sets the memory budget of the rendered album page cache.
+
+    :param max_bytes: Maximum total size of cached pages in bytes.
+    """
+    album_page_cache.resize(max_bytes)
 
 
 class Album:
@@ -44,16 +79,17 @@ class Album:
             f'<@{ctx.message.author.id }> ' + content
         )
 
-    async def __handle_album_result(self, ctx, album_size, image):
+    async def __handle_album_result(self, ctx, user_args, album_size, image):
         if not image:
             await self.__send_error_msg(ctx, 'No matching cards found.')
-            _last_user_args[ctx.message.author.id] = _get_new_user_args()
+            user_args.update(_get_new_user_args())
         else:
-            page = _last_user_args[ctx.message.author.id]["page"]
+            page = user_args["page"]
             max_page = int(math.ceil(album_size / PAGE_SIZE))
             msg = (f'<@{ctx.message.author.id}> Page {page+1} of {max_page}. '
                    f'`!help album` for more info.')
-            await self.bot.upload(image, filename='a.png', content=msg)
+            fname = 'a.' + image_extension('album')
+            await self.bot.upload(image, filename=fname, content=msg)
 
     async def __handle_view_result(self, ctx, image):
         if not image:
@@ -73,6 +109,25 @@ class Album:
             msg = f'<@{ctx.message.author.id}>'
             await self.bot.upload(image, filename='c.png', content=msg)
 
+    async def __get_album_page(self, user: User, user_args: dict) -> tuple:
+        """
+        Gets a user's last requested album page, filtering, sorting and
+            paginating in the database.
+
+        :param user: User who requested the album.
+        :param user_args: The user's album arguments.
+
+        :return: Tuple of (list of cards on the page, number of matching
+            album entries).
+        """
+        sort, descending = _get_sort_field(user_args['sort'])
+        album, album_size, page = await self.bot.db.users.get_album_page(
+            user.id, user_args['filters'], sort, descending,
+            user_args['page'], PAGE_SIZE
+        )
+        user_args['page'] = page
+        return album, album_size
+
     @commands.command(pass_context=True, aliases=['a'])
     @commands.cooldown(rate=3, per=2.5, type=commands.BucketType.user)
     @commands.check(check_mongo)
@@ -96,18 +151,45 @@ class Album:
             Rarity (UR, SSR, SR, R, N)
         """
         user = ctx.message.author
-        album = await self.bot.db.users.get_user_album(user.id, True)
-        _parse_album_arguments(self.bot, args, user)
-        album = _apply_filter(album, user)
-        album = _apply_sort(album, user)
-        album = _seperate_idolized(album)
-        filtered_album_size = len(album)
-        album = _splice_page(album, user)
-
-        image = await create_image(
-            self.bot.session_manager, album, ROWS, True, True
-        ) if len(album) > 0 else None
-        await self.__handle_album_result(ctx, filtered_album_size, image)
+        state_key = f'album:{user.id}'
+        user_args = await album_state.get(state_key) or _get_new_user_args()
+        _parse_album_arguments(self.bot, args, user_args)
+
+        # The version changes on every album write, so cached pages of an
+        # old version are never shown again.
+        version = await self.bot.db.users.get_album_version(user.id)
+        cache_key = _get_page_cache_key(user, user_args, version)
+        cached_page = album_page_cache.get(cache_key)
+        if cached_page:
+            image, filtered_album_size, user_args['page'] = cached_page
+            await self.__handle_album_result(
+                ctx, user_args, filtered_album_size, BytesIO(image))
+            await album_state.put(state_key, user_args)
+            return
+
+        if self.bot.config.get('album_pipeline', 'python') == 'mongo':
+            album, filtered_album_size = await self.__get_album_page(
+                user, user_args)
+        else:
+            album = await self.bot.db.users.get_user_album(user.id, True)
+            with span('album.sort'):
+                album = _apply_sort(
+                    _apply_filter(album, user_args), user_args)
+                filtered_album_size = _count_idolized_split(album)
+                album = _splice_page(album, filtered_album_size, user_args)
+
+        image = None
+        if len(album) > 0:
+            image = await create_image(
+                self.bot.session_manager, album, ROWS, True, True, 'album')
+            album_page_cache.put(cache_key, (
+                image.getvalue(),
+                filtered_album_size,
+                user_args['page']
+            ))
+        await self.__handle_album_result(
+            ctx, user_args, filtered_album_size, image)
+        await album_state.put(state_key, user_args)
 
     @commands.command(pass_context=True, aliases=['v'])
     @commands.cooldown(rate=3, per=2.5, type=commands.BucketType.user)
@@ -154,10 +236,7 @@ class Album:
             elif card:
                 img_url = 'http:' + card['card_image']
 
-            fname = basename(urlsplit(img_url).path)
-            image_path = idol_img_path.joinpath(fname)
-            image = await get_one_img(
-                    img_url, image_path, self.bot.session_manager)
+            image = await get_one_img(img_url, self.bot.session_manager)
 
         await self.__handle_view_result(ctx, image)
 
@@ -169,109 +248,176 @@ class Album:
         Description: |
             Idolizes a card in your album. You must have two copies of the card.
             For example, !idolize 1200.
+            Use !idolize all to idolize every card you have two copies of.
 
         Arguments: |
-            Card ID (This is the left number of a card in your album)
+            Card ID (This is the left number of a card in your album) or all
         """
         user = ctx.message.author
         card_id = 0
 
         # Parse args for card id and idolized.
         for arg in args:
+            if arg.lower() == 'all':
+                await self.__idolize_all(ctx)
+                return
             if _is_number(arg):
                 card_id = int(arg)
 
         image = None
-        card = await self.bot.db.users.get_card_from_album(user.id, card_id)
+        card_infos = await self.bot.db.cards.get_card_infos([card_id])
+        card = card_infos.get(card_id, None)
 
-        if not card:
+        can_idolize = card is not None and _can_idolize(card)
+        if can_idolize and await self.bot.db.users.idolize_card(
+                user.id, card_id):
+            self.bot.record_leaderboards(ctx)
+            img_url = 'http:' + card['card_idolized_image']
+            image = await get_one_img(img_url, self.bot.session_manager)
+        # Album membership is checked before whether the card can actually
+        # be idolized.
+        elif not await self.bot.db.users.get_card_from_album(
+                user.id, card_id):
             await self.__send_error_msg(
                     ctx, 'This card does not exist in your album.')
-            return 
-
-        # Check to make sure the card can actually be idolized.
-        round_img = card['round_card_image']
-        round_card_i_img = card['round_card_idolized_image']
-        if card['card_idolized_image'] == None or round_img == round_card_i_img:
+            return
+        elif not can_idolize:
             await self.__send_error_msg(ctx, 'This card cannot be idolized.')
-            return 
+            return
 
-        if card and card['unidolized_count'] >= 2:
-            card['_id'] = card['id']
-            await self.bot.db.users.remove_from_user_album(
-                    user.id, card_id, count=2)
-            await self.bot.db.users.add_to_user_album(
-                    user.id, [card], idolized=True)
+        await self.__handle_idolize_result(ctx, image)
 
-            img_url = 'http:' + card['card_idolized_image']
-            fname = basename(urlsplit(img_url).path)
-            image_path = idol_img_path.joinpath(fname)
-            image = await get_one_img(
-                    img_url, image_path, self.bot.session_manager)
+    async def __idolize_all(self, ctx):
+        """
+        Idolizes every card a user has two unidolized copies of.
 
-        await self.__handle_idolize_result(ctx, image)
+        :param ctx: the context.
+        """
+        card_ids = [
+            card['_id'] for card in self.bot.db.cards.catalog.cards()
+            if _can_idolize(card)
+        ]
+        count = await self.bot.db.users.idolize_all(
+            ctx.message.author.id, card_ids)
+        if not count:
+            await self.__send_error_msg(
+                ctx, 'You do not have two copies of any card to idolize.')
+            return
+        self.bot.record_leaderboards(ctx)
+        await self.bot.send_message(
+            ctx.message.channel,
+            f'<@{ctx.message.author.id}> Idolized {count} different cards. '
+            f'`!album` to see them.'
+        )
+
+
+def _can_idolize(card: dict) -> bool:
+    """
+    Checks if a card has an idolized form.
 
+    :param card: Card dictionary with card information.
 
-def _apply_filter(album: list, user: User):
+    :return: True if the card can be idolized, otherwise False.
     """
-    Applys a user's filters to a card album, removing anything not matching
+    round_img = card['round_card_image']
+    round_card_i_img = card['round_card_idolized_image']
+    return card['card_idolized_image'] != None and round_img != round_card_i_img
+
+
+def _apply_filter(album: list, user_args: dict):
+    """
+    Applys a user's filters to a card album, skipping anything not matching
         the filter.
 
     :param album: Album being filtered.
-    :param user: User who requested the album.
+    :param user_args: Album arguments of the user who requested the album.
 
-    :return: Filtered album.
+    :return: Generator of matching cards.
     """
-    filters = _last_user_args[user.id]['filters']
-
-    for filter_type in filters:
-        filter_values = filters[filter_type]
+    filters = [
+        (filter_type, set(filter_values))
+        for filter_type, filter_values
+        in user_args['filters'].items()
+        if filter_values
+    ]
 
-        if not filter_values:
-            continue
+    for card in album:
+        if all(card[filter_type] in filter_values
+               for filter_type, filter_values in filters):
+            yield card
 
-        # Looping backwards since we are removing elements
-        for i in range(len(album) - 1, -1, -1):
-            # Generic case
-            if album[i][filter_type] not in filter_values:
-                album.pop(i)
 
-    return album
+def _seperate_idolized(album: list):
+    """
+    Splits an album into the unidolized and idolized copies shown on album
+        pages. Cards are not copied.
 
-def _seperate_idolized(album: list) -> list:
-    # Looping backwards since we are adding elements
-    for i in range(len(album) - 1, -1, -1):
-        album[i]['idolized'] = False
-        cp = deepcopy(album[i])
-        cp['idolized'] = True
-        album.insert(i + 1, cp)
+    :param album: Album being split.
 
-    # Looping backwards since we are removing elements
-    for i in range(len(album) - 1, -1, -1):
+    :return: Generator of (card, idolized) tuples.
+    """
+    for card in album:
         # Filter out cards that should not be displayed.
-        if not album[i]['idolized'] and album[i]['unidolized_count'] <= 0:
-            album.pop(i)
-        if album[i]['idolized'] and album[i]['idolized_count'] <= 0:
-            album.pop(i)
+        if card['unidolized_count'] > 0:
+            yield card, False
+        if card['idolized_count'] > 0:
+            yield card, True
 
-    return album
 
-def _apply_sort(album: list, user: User) -> list:
+def _count_idolized_split(album: list) -> int:
+    """
+    Counts the entries _seperate_idolized yields for an album.
+
+    :param album: Album being counted.
+
+    :return: Number of displayed album entries.
+    """
+    return sum(
+        (card['unidolized_count'] > 0) + (card['idolized_count'] > 0)
+        for card in album
+    )
+
+
+def _apply_sort(album, user_args: dict) -> list:
     """
     Applys a user's sort to a card album.
 
-    :param album: Album being sorted.
-    :param user: User who requested the album.
+    :param album: Iterable of cards being sorted.
+    :param user_args: Album arguments of the user who requested the album.
 
     :return: Sorted album.
     """
-    sort = _last_user_args[user.id]['sort']
-
     # FIXME This var doesn't seem to have any use.
-    order = _last_user_args[user.id]['order']
+    order = user_args['order']
 
+    sort, sort_descending = _get_sort_field(user_args['sort'])
     if not sort:
-        return album
+        return list(album)
+
+    # Cards without a value for the sort go last, in album order.
+    sorted_list = []
+    unsorted_list = []
+    for card in album:
+        if card[sort]:
+            sorted_list.append(card)
+        else:
+            unsorted_list.append(card)
+
+    sorted_list.sort(key=itemgetter(sort, 'id'), reverse=sort_descending)
+    sorted_list.extend(unsorted_list)
+    return sorted_list
+
+
+def _get_sort_field(sort: str) -> tuple:
+    """
+    Gets the album field and direction of a sort argument.
+
+    :param sort: Sort argument from SORTS or None.
+
+    :return: Tuple of (album field or None, whether to sort descending).
+    """
+    if not sort:
+        return None, False
     if sort == 'date':
         sort = 'release_date'
     if sort == 'unit':
@@ -289,56 +435,51 @@ def _apply_sort(album: list, user: User) -> list:
         'main_unit',
         'sub_unit'
     ]
+    return sort, sort_descending
 
-    sorted_list = sorted(
-            filter(lambda card: card[sort], album), 
-            key=itemgetter(sort, 'id'), 
-            reverse=sort_descending)
-    return sorted_list + [card for card in album if not card[sort]]
 
-
-def _splice_page(album: list, user: User) -> list:
+def _splice_page(album: list, album_size: int, user_args: dict) -> list:
     """
-    Splices a user's last requested page out of their album.
+    Splices a user's last requested page out of their album, building only
+        the entries on that page.
 
-    :param album: Album being spliced
-    :param user: User who requested the album.
+    :param album: Filtered and sorted album being spliced.
+    :param album_size: Number of displayed entries in the album.
+    :param user_args: Album arguments of the user who requested the album.
 
-    :return: Spliced album.
+    :return: List of card dictionaries on the page.
     """
-    page = _last_user_args[user.id]['page']
-    max_page = int(math.ceil(len(album) / PAGE_SIZE)) - 1
+    page = user_args['page']
+    max_page = int(math.ceil(album_size / PAGE_SIZE)) - 1
 
     if page > max_page:
         page = max_page
     if page < 0:
         page = 0
-    _last_user_args[user.id]['page'] = page
+    user_args['page'] = page
 
     start = PAGE_SIZE * page
     end = (PAGE_SIZE * page) + PAGE_SIZE
-    return album[start:end]
+    entries = islice(_seperate_idolized(album), start, end)
+    return [dict(card, idolized=idolized) for card, idolized in entries]
 
 
-def _parse_album_arguments(bot, args: tuple, user: User):
+def _parse_album_arguments(bot, args: tuple, user_args: dict):
     """
     Parse arguments to get how an album will be sorted and filtered. The parsed
         arguments are stored in the user's last used arguments dictionary.
 
     :param args: Tuple of arguments.
-    :param user: User who requested the album.
+    :param user_args: Last used album arguments of the user who requested the
+        album.
     """
-    # Add user to last used argument dictionary if they don't already exist.
-    if user.id not in _last_user_args:
-        _last_user_args[user.id] = _get_new_user_args()
-
     # Get values of user's last album preview.
-    page = _last_user_args[user.id]['page']
-    filters = _last_user_args[user.id]['filters']
-    sort = _last_user_args[user.id]['sort']
+    page = user_args['page']
+    filters = user_args['filters']
+    sort = user_args['sort']
 
     # FIXME This var doesn't seem to have any use.
-    order = _last_user_args[user.id]['order']
+    order = user_args['order']
 
     new_filters = parse_arguments(bot, args, True)
     if _has_filter(new_filters):
@@ -373,9 +514,26 @@ def _parse_album_arguments(bot, args: tuple, user: User):
         if _is_number(arg):
             page = int(arg) - 1
 
-        _last_user_args[user.id]['page'] = page
-        _last_user_args[user.id]['filters'] = filters
-        _last_user_args[user.id]['sort'] = sort
+        user_args['page'] = page
+        user_args['filters'] = filters
+        user_args['sort'] = sort
+
+
+def _get_page_cache_key(user: User, user_args: dict, version: int) -> tuple:
+    """
+    Gets the album page cache key of a user's last used album arguments.
+
+    :param user: User who requested the album.
+    :param user_args: The user's album arguments.
+    :param version: Current version of the user's album.
+
+    :return: Hashable cache key.
+    """
+    filters = tuple(
+        (filter_type, tuple(values))
+        for filter_type, values in sorted(user_args['filters'].items())
+    )
+    return user.id, version, filters, user_args['sort'], user_args['page']
 
 
 def _get_new_user_args():
@@ -0,0 +1,48 @@
+import discord
+from discord.ext import commands
+from core.checks import check_mongo
+from bot import HahaNoUR
+from data_controller.leaderboard_controller import GLOBAL_SCOPE, \
+    LEADERBOARD_METRICS
+
+
+class Leaderboard:
+    def __init__(self, bot: HahaNoUR):
+        self.bot = bot
+
+    @commands.command(pass_context=True, aliases=['lb'])
+    @commands.cooldown(rate=3, per=10, type=commands.BucketType.user)
+    @commands.check(check_mongo)
+    async def leaderboard(self, ctx, *args: str):
+        """
+        Description: |
+            Shows who has collected the most cards in this server.
+            For example, !leaderboard ur or !leaderboard unique global
+
+        Optional Arguments: |
+            Metric (unique, total, ur, ssr)
+            Global (Shows the leaderboard of all users)
+        """
+        metric = 'unique'
+        scope = ctx.message.server.id if ctx.message.server else GLOBAL_SCOPE
+        for arg in args:
+            arg = arg.lower()
+            if arg in LEADERBOARD_METRICS:
+                metric = arg
+            if arg == 'global':
+                scope = GLOBAL_SCOPE
+
+        entries = await self.bot.db.leaderboards.get_leaderboard(
+            scope, metric)
+        description = LEADERBOARD_METRICS[metric][1]
+        where = 'everyone' if scope == GLOBAL_SCOPE else 'this server'
+        title = f'{description} leaderboard for {where}'
+        if not entries:
+            desc = 'Nobody is on this leaderboard yet.'
+        else:
+            desc = '\n'.join(
+                f'{place}. <@{user_id}>: {value}'
+                for place, (user_id, value) in enumerate(entries, 1)
+            )
+        emb = discord.Embed(title=title, description=desc)
+        await self.bot.send_message(ctx.message.channel, embed=emb)
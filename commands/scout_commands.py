@@ -30,10 +30,9 @@ class Scout:
             content=f'<@{ctx.message.author.id}>'
         )
 
-        if not await self.bot.db.users.find_user(ctx.message.author.id):
-            await self.bot.db.users.insert_user(ctx.message.author.id)
         await self.bot.db.users.add_to_user_album(
                 ctx.message.author.id, results)
+        self.bot.record_leaderboards(ctx)
 
     @commands.command(pass_context=True)
     @commands.cooldown(rate=5, per=2.5, type=commands.BucketType.user)
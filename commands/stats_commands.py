@@ -2,11 +2,18 @@ import discord
 from discord.ext import commands
 from core.checks import check_mongo
 from bot import HahaNoUR
+from data_controller.album_stats import STATS_ATTRIBUTES, STATS_RARITIES
 
 class Stats:
     def __init__(self, bot: HahaNoUR):
         self.bot = bot
 
+    async def __send_error_msg(self, ctx, content):
+        await self.bot.send_message(
+            ctx.message.channel,
+            f'<@{ctx.message.author.id}> ' + content
+        )
+
     @commands.command(pass_context=True, aliases=['stats'])
     @commands.cooldown(rate=3, per=10, type=commands.BucketType.user)
     @commands.check(check_mongo)
@@ -16,20 +23,25 @@ class Stats:
             Provides stats about you.
         """
         user_id = ctx.message.author.id
+        counts = await self.bot.db.users.get_album_stats(user_id)
+        if counts is None:
+            counts = await self.bot.db.users.recount_album_stats(user_id)
+
+        # Counters only exist once they were first incremented.
+        rarity_counts = counts.get('rarity', {})
+        attribute_counts = counts.get('attribute', {})
 
         stats = []
-        album = await self.bot.db.users.get_user_album(user_id, True)
-        counter = AlbumCounter(album)
-        counter.run_count()
-        stats.append(('Unique cards collected', counter.distinct_count))
-        stats.append(('Total cards', counter.total_count))
-        stats.append(('Unidolized cards', counter.unidolized_count))
-        stats.append(('Idolized cards', counter.idolized_count))
+        stats.append(('Unique cards collected', counts.get('distinct', 0)))
+        stats.append(('Total cards', counts.get('total', 0)))
+        stats.append(('Unidolized cards', counts.get('unidolized', 0)))
+        stats.append(('Idolized cards', counts.get('idolized', 0)))
 
-        for rarity, count in counter.rarity_counts.items():
-            stats.append((rarity + ' cards', count))
+        for rarity in STATS_RARITIES:
+            stats.append((rarity + ' cards', rarity_counts.get(rarity, 0)))
 
-        for attribute, count in counter.attribute_counts.items():
+        for attribute in STATS_ATTRIBUTES:
+            count = attribute_counts.get(attribute, 0)
             stats.append((attribute + ' cards', count))
 
         emb = _create_embed('Stats for ' + ctx.message.author.name, stats)
@@ -43,37 +55,22 @@ class Stats:
         Description: |
             Provides stats about the bot.
         """
+        # Refreshed in the background, wait for the first refresh.
+        counters = self.bot.db.stats.counters
+        if counters is None:
+            await self.__send_error_msg(
+                ctx, 'Stats are still being counted, try again later.')
+            return
+
         stats = []
-        stats.append(('Servers', len(self.bot.servers)))
-        stats.append(('Users', await self.bot.db.users.get_user_count()))
+        stats.append(('Servers', counters['servers']))
+        stats.append(('Users', counters['users']))
+        stats.append(('Cards', counters['cards']))
 
         emb = _create_embed('My stats', stats)
         await self.bot.send_message(ctx.message.channel, embed=emb)
 
 
-class AlbumCounter:
-    def __init__(self, album):
-        self.album = album
-        self.rarity_counts = {'N': 0, 'R': 0, 'SR': 0, 'SSR': 0, 'UR': 0}
-        self.attribute_counts = {'Smile': 0, 'Pure': 0, 'Cool': 0, 'All': 0}
-        self.total_count = 0
-        self.unidolized_count = 0
-        self.idolized_count = 0
-        self.distinct_count = 0
-
-    def run_count(self):
-        for card in self.album:
-            curr_total = card['unidolized_count'] + card['idolized_count']
-
-            self.rarity_counts[card['rarity']] += curr_total
-            self.attribute_counts[card['attribute']] += curr_total
-            self.unidolized_count += card['unidolized_count']
-            self.idolized_count += card['idolized_count']
-
-        self.total_count = self.idolized_count + self.unidolized_count
-        self.distinct_count = len(self.album)
-
-
 def _create_embed(title: str, stats: list):
     """
     Create a stats embed.
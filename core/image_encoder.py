@@ -0,0 +1,84 @@
+from collections import namedtuple
+from io import BytesIO
+
+from PIL import Image
+
+# Supported output formats mapped to their file extensions.
+FORMATS = {
+    'png': 'png',
+    'webp': 'webp'
+}
+
+
+class Encoder(namedtuple('Encoder', (
+        'format', 'compress_level', 'optimize', 'colours', 'lossless',
+        'quality', 'method', 'scale'))):
+    """
+    Settings used to encode an output image.
+
+    format: Output format (png, webp).
+    compress_level: zlib compression level of PNGs, 0 to 9.
+    optimize: Whether to search for the smallest PNG encoding.
+    colours: Number of palette colours to quantise PNGs to, 0 to disable.
+    lossless: Whether WebP images are lossless.
+    quality: Quality of lossy WebP images, 0 to 100.
+    method: WebP encoding effort, 0 (fast) to 6 (small).
+    scale: Factor the image is resized by before encoding.
+    """
+    __slots__ = ()
+
+    @property
+    def extension(self) -> str:
+        return FORMATS[self.format]
+
+
+DEFAULT_ENCODER = Encoder('png', 6, False, 0, True, 80, 4, 1.0)
+
+
+def get_encoder(options: dict) -> Encoder:
+    """
+    Creates an encoder from a dictionary of settings, unspecified settings
+        use the default values.
+
+    :param options: Dictionary of encoder settings.
+
+    :return: The encoder.
+    """
+    encoder = DEFAULT_ENCODER._replace(**options)
+    if encoder.format not in FORMATS:
+        raise ValueError(f'Unknown image format {encoder.format}')
+    if encoder.scale <= 0:
+        raise ValueError('Image scale must be positive')
+    return encoder
+
+
+def encode_image(image: Image, encoder: Encoder) -> bytes:
+    """
+    Encodes an image.
+
+    :param image: Image to encode.
+    :param encoder: Encoder settings.
+
+    :return: Encoded image.
+    """
+    if encoder.scale != 1:
+        width, height = image.size
+        size = (max(1, round(width * encoder.scale)),
+                max(1, round(height * encoder.scale)))
+        image = image.resize(size, Image.LANCZOS)
+
+    res = BytesIO()
+    if encoder.format == 'webp':
+        image.save(
+            res, 'WEBP', lossless=encoder.lossless, quality=encoder.quality,
+            method=encoder.method
+        )
+    else:
+        if encoder.colours:
+            # Fast octree is the only method supporting transparency.
+            image = image.quantize(colors=encoder.colours, method=2)
+        image.save(
+            res, 'PNG', compress_level=encoder.compress_level,
+            optimize=encoder.optimize
+        )
+    return res.getvalue()
@@ -0,0 +1,108 @@
+from asyncio import Semaphore, ensure_future, gather, get_event_loop, shield
+from logging import INFO
+from typing import TYPE_CHECKING
+from urllib.parse import urlsplit
+
+from core.image_store import ImageStore, image_name
+
+if TYPE_CHECKING:
+    from bot.session_manager import SessionManager
+
+
+class ImageFetcher:
+    """
+    Gets images from an ImageStore, downloading them if they are missing.
+        Concurrent downloads of the same image are merged into one, file I/O
+        runs off the event loop and downloads are limited per host.
+    """
+
+    def __init__(self, store: ImageStore, per_host: int = 4):
+        """
+        Constructor for an ImageFetcher.
+
+        :param store: Store downloaded images are saved to.
+        :param per_host: Maximum number of concurrent downloads per host.
+        """
+        self.store = store
+        self.per_host = per_host
+        self._in_flight = {}
+        self._host_slots = {}
+
+    async def fetch(self, url: str,
+                    session_manager: 'SessionManager') -> bytes:
+        """
+        Get an image, downloading it if it is not in the store.
+
+        :param url: url of image
+        :param session_manager: the SessionManager
+        :return: the image.
+        """
+        name = image_name(url)
+        image = await get_event_loop().run_in_executor(
+            None, self.store.read, name)
+        if image is None:
+            image = await self.download(url, session_manager)
+        return image
+
+    async def fetch_missing(self, urls: list,
+                            session_manager: 'SessionManager'):
+        """
+        Concurrently download every image not in the store.
+
+        :param urls: list of image urls.
+        :param session_manager: the SessionManager
+        """
+        missing = await get_event_loop().run_in_executor(
+            None, self.find_missing, urls)
+        await gather(*(self.download(url, session_manager) for url in missing))
+
+    async def download(self, url: str,
+                       session_manager: 'SessionManager') -> bytes:
+        """
+        Download an image to the store, joining an ongoing download of the
+            same image if there is one.
+
+        :param url: url of image
+        :param session_manager: the SessionManager
+        :return: the image.
+        """
+        name = image_name(url)
+        future = self._in_flight.get(name)
+        if future is None:
+            future = ensure_future(
+                self._do_download(url, name, session_manager))
+            self._in_flight[name] = future
+            future.add_done_callback(
+                lambda _: self._in_flight.pop(name, None))
+        # Shielded so a cancelled request does not cancel other waiters.
+        return await shield(future)
+
+    async def _do_download(self, url: str, name: str,
+                           session_manager: 'SessionManager') -> bytes:
+        host = urlsplit(url).netloc
+        if host not in self._host_slots:
+            self._host_slots[host] = Semaphore(self.per_host)
+
+        async with self._host_slots[host]:
+            resp = await session_manager.get(url)
+            async with resp:
+                image = await resp.read()
+
+        session_manager.logger.log(INFO, f'Saving {url} as {name}')
+        await get_event_loop().run_in_executor(
+            None, self.store.write, name, image)
+        return image
+
+    def find_missing(self, urls: list) -> list:
+        """
+        Finds the images that are not in the store. This does file I/O.
+
+        :param urls: list of image urls.
+        :return: list of urls of missing images, without duplicates.
+        """
+        missing = {}
+        for url in urls:
+            name = image_name(url)
+            if name not in missing and not self.store.contains(name):
+                missing[name] = url
+        return list(missing.values())
@@ -1,15 +1,27 @@
-from collections import deque
+from asyncio import Semaphore, gather, get_event_loop
+from collections import deque, namedtuple
+from functools import lru_cache
 from io import BytesIO
-from logging import INFO
+from logging import WARN
 from pathlib import Path
-from typing import List, Sequence, Tuple
-from urllib.parse import urlsplit
+from time import perf_counter
+from typing import TYPE_CHECKING, List, Sequence, Tuple
 
 from PIL import Image, ImageDraw, ImageFont
 
-from bot import SessionManager
+from core.image_encoder import DEFAULT_ENCODER, Encoder, encode_image, \
+    get_encoder
+from core.image_fetcher import ImageFetcher
+from core.image_store import ImageStore, image_name
+from core.lru_cache import LRUCache
+from core.render_pool import RenderPool
+from core.sprite_atlas import SpriteAtlas, sprite_key
+from core.tracing import record, span
 from idol_images import idol_img_path
 
+if TYPE_CHECKING:
+    from bot.session_manager import SessionManager
+
 CIRCLE_DISTANCE = 10
 LABEL_COLOURS = {
     "Smile": "#FF6698", 
@@ -18,10 +30,163 @@ LABEL_COLOURS = {
     "All": "#CC76E4"
 }
 
+LABEL_FONT = 'arial.ttf'
+# Font size used on labels.
+LABEL_FONT_SIZE = 18
+# Number of rendered labels kept per process.
+LABEL_CACHE_SIZE = 4096
+
+# Card images downloaded ahead of time by prefetch_card_images.
+PREFETCH_FIELDS = (
+    'round_card_image',
+    'round_card_idolized_image',
+    'card_image',
+    'card_idolized_image'
+)
+PREFETCH_CONCURRENCY = 4
+
+# Default memory budget for decoded images, in bytes.
+IMAGE_CACHE_BYTES = 64 * 1024 * 1024
+
+# A circle to render: the image file path, the sprite atlas key, and the
+# label texts and colour or None if the circle is not labelled.
+Circle = namedtuple('Circle', ('path', 'sprite', 'texts', 'colour'))
+
+
+def _image_size(img: Image) -> int:
+    width, height = img.size
+    return width * height * len(img.getbands())
+
+
+# Decoded circle images keyed by file name, and labelled circle images keyed
+# by (file name, label texts, label colour). Each render worker process has
+# its own cache.
+image_cache = LRUCache(IMAGE_CACHE_BYTES, _image_size)
+
+render_pool = RenderPool()
+
+# Default size budget of the image store on disk, in bytes.
+IMAGE_STORE_BYTES = 4 * 1024 * 1024 * 1024
+
+image_store = ImageStore(idol_img_path, IMAGE_STORE_BYTES)
+
+image_fetcher = ImageFetcher(image_store)
+
+sprite_atlas = SpriteAtlas(idol_img_path.joinpath('atlas'))
+
+# Output encoders keyed by profile name, profiles without an encoder use the
+# default one.
+encoders = {'default': DEFAULT_ENCODER}
+
+# Encode counters keyed by profile name.
+encode_stats = {}
+
+
+def configure_image_cache(max_bytes: int):
+    """
+    Sets the memory budget of the decoded image cache.
+
+    :param max_bytes: Maximum total size of cached images in bytes.
+    """
+    image_cache.resize(max_bytes)
+
+
+def configure_render_pool(kind: str, workers: int, max_pending: int):
+    """
+    Replaces the pool images are rendered on.
+
+    :param kind: Type of pool to use (thread, process).
+    :param workers: Number of worker threads or processes.
+    :param max_pending: Maximum number of renders queued or running.
+    """
+    global render_pool
+    old_pool = render_pool
+    render_pool = RenderPool(kind, workers, max_pending)
+    old_pool.shutdown(wait=False)
+
+
+def configure_encoders(profiles: dict):
+    """
+    Sets the output encoders.
+
+    :param profiles: Dictionary mapping profile names to dictionaries of
+        encoder settings.
+    """
+    encoders.clear()
+    encoders['default'] = DEFAULT_ENCODER
+    for name, options in profiles.items():
+        encoders[name] = get_encoder(options)
+
+
+def get_profile_encoder(profile: str) -> Encoder:
+    """
+    Gets the encoder of a profile.
+
+    :param profile: Profile name.
+    :return: the encoder.
+    """
+    return encoders.get(profile, encoders['default'])
+
+
+def image_extension(profile: str) -> str:
+    """
+    Gets the file extension of images encoded with a profile.
+
+    :param profile: Profile name.
+    :return: the file extension.
+    """
+    return get_profile_encoder(profile).extension
+
+
+def _record_encode(profile: str, seconds: float, size: int):
+    stats = encode_stats.setdefault(
+        profile, {'count': 0, 'seconds': 0.0, 'bytes': 0})
+    stats['count'] += 1
+    stats['seconds'] += seconds
+    stats['bytes'] += size
+
+
+def encode_counters() -> dict:
+    """
+    Gets the encode counters of every profile, with the average encode time
+        and output size to compare encoder settings by.
+
+    :return: Dictionary mapping '<profile>.<counter>' to values.
+    """
+    counters = {}
+    for profile, stats in sorted(encode_stats.items()):
+        count = stats['count']
+        counters[f'{profile}.count'] = count
+        counters[f'{profile}.avg_ms'] = round(
+            stats['seconds'] * 1000 / count, 1)
+        counters[f'{profile}.avg_bytes'] = stats['bytes'] // count
+    return counters
+
+
+def configure_image_store(max_bytes: int):
+    """
+    Sets the size budget of the image store and loads its index.
+
+    :param max_bytes: Maximum total size of stored images in bytes.
+    """
+    image_store.max_bytes = max_bytes
+    image_store.load()
+
+
+def configure_image_fetcher(per_host: int):
+    """
+    Sets the download limit of the image fetcher.
+
+    :param per_host: Maximum number of concurrent downloads per host.
+    """
+    image_fetcher.per_host = per_host
+
+
 # TODO seperate function that album_command calls.
-async def create_image(session_manager: SessionManager, cards: list,
-                       num_rows: int, align: bool=False,
-                       add_labels: bool=False) -> BytesIO:
+async def create_image(session_manager: 'SessionManager',
+                       cards: list, num_rows: int, align: bool=False,
+                       add_labels: bool=False,
+                       profile: str='default') -> BytesIO:
     """
     Creates a stitched together scout image of idol circles.
     :param session_manager: the SessionManager
@@ -29,12 +194,14 @@ async def create_image(session_manager: SessionManager, cards: list,
     :param num_rows: Number of rows to use in the image
     :param align: to align middle the image or not.
     :param add_labels: to add labels or not.
-    :return: path pointing to created image
+    :param profile: name of the encoder profile to use.
+    :return: the encoded image
     """
     # TODO, cards in album_cards dictionary will need an extra property.
     num_rows = min((num_rows, len(cards)))
 
-    imgs = []
+    circles = []
+    downloads = []
     for card in cards:
         image_field = 'round_card_image'
         count_field = 'unidolized_count'
@@ -48,47 +215,141 @@ async def create_image(session_manager: SessionManager, cards: list,
             count_field = 'idolized_count'
 
         url = "http:" + card[image_field]
-        url_path = Path(urlsplit(url).path)
-        file_path = idol_img_path.joinpath(url_path.name)
-        next_img = Image.open(
-                await get_one_img(url, file_path, session_manager))
+        sprite = sprite_key(card['_id'], image_field)
+        if sprite not in sprite_atlas:
+            downloads.append(url)
 
+        texts, colour = None, None
         if add_labels:
-            texts = [str(card['_id']), str(card[count_field])]
-            next_img = _add_label(
-                    next_img, texts, LABEL_COLOURS[card['attribute']])
+            texts = (str(card['_id']), str(card[count_field]))
+            colour = LABEL_COLOURS[card['attribute']]
+
+        path = image_store.path(image_name(url))
+        circles.append(Circle(str(path), sprite, texts, colour))
+
+    with span('fetch'):
+        await image_fetcher.fetch_missing(downloads, session_manager)
+    start = perf_counter()
+    image, encode_time = await render_pool.run(
+        render_image, circles, num_rows, align,
+        get_profile_encoder(profile), image_cache.max_bytes)
+    # Rendering includes the time spent queued on the render pool.
+    record('render', perf_counter() - start - encode_time)
+    record('encode', encode_time)
+    _record_encode(profile, encode_time, len(image))
+    return BytesIO(image)
+
+
+def render_image(circles: list, num_rows: int, align: bool,
+                 encoder: Encoder, cache_bytes: int) -> tuple:
+    """
+    Renders circles to an image. This runs on the render pool.
 
+    :param circles: list of Circle tuples to render.
+    :param num_rows: Number of rows to use in the image
+    :param align: to align middle the image or not.
+    :param encoder: the output encoder.
+    :param cache_bytes: Memory budget of the worker's image cache.
+    :return: the encoded image and the time spent encoding it in seconds.
+    """
+    if image_cache.max_bytes != cache_bytes:
+        image_cache.resize(cache_bytes)
+    sprite_atlas.reload_if_due()
+
+    imgs = []
+    for circle in circles:
+        name = Path(circle.path).name
+        if circle.texts:
+            key = (name, circle.texts, circle.colour)
+            next_img = image_cache.get(key)
+            if next_img is None:
+                next_img = _add_label(
+                    _get_circle(circle), circle.texts, circle.colour)
+                image_cache.put(key, next_img)
+        else:
+            next_img = _get_circle(circle)
         imgs.append(next_img)
 
-    res = BytesIO()
-    # Load images
     image = _build_image(imgs, num_rows, 10, 10, align)
-    image.save(res, 'PNG')
-    return BytesIO(res.getvalue())
+    start = perf_counter()
+    encoded = encode_image(image, encoder)
+    return encoded, perf_counter() - start
+
+
+async def reload_sprite_atlas():
+    """
+    Picks up a rebuilt sprite atlas without blocking the event loop.
+    """
+    await get_event_loop().run_in_executor(None, sprite_atlas.reload)
 
 
-async def get_one_img(url: str, path: Path,
-                      session_manager: SessionManager) -> BytesIO:
+async def prefetch_card_images(session_manager: 'SessionManager',
+                               cards: list,
+                               concurrency: int=PREFETCH_CONCURRENCY) -> int:
+    """
+    Download every image of a list of cards that is not in the image store.
+    :param session_manager: the SessionManager
+    :param cards: cards to get the images of.
+    :param concurrency: maximum number of images downloaded at once.
+    :return: the number of images downloaded.
+    """
+    urls = [
+        'http:' + card[field]
+        for card in cards for field in PREFETCH_FIELDS if card.get(field)
+    ]
+    missing = await get_event_loop().run_in_executor(
+        None, image_fetcher.find_missing, urls)
+    slots = Semaphore(concurrency)
+
+    async def download(url):
+        async with slots:
+            try:
+                await image_fetcher.download(url, session_manager)
+                return True
+            except Exception as e:
+                session_manager.logger.log(
+                    WARN, f'Could not prefetch {url}: {e}')
+                return False
+
+    results = await gather(*(download(url) for url in missing))
+    return sum(results)
+
+
+async def get_one_img(url: str,
+                      session_manager: 'SessionManager') -> BytesIO:
     """
     Get a single image. If image is not found in local storge, download it.
 
     :param url: url of image
-    :param path: path where image will be saved to
     :param session_manager: the SessionManager
     :return: a BytesIO of the image.
     """
-    if path.is_file():
-        return BytesIO(path.read_bytes())
-    resp = await session_manager.get(url)
-    async with resp:
-        session_manager.logger.log(
-            INFO, 'Saving ' + url + ' to ' + str(path))
-        image = await resp.read()
-        path.write_bytes(image)
-        return BytesIO(image)
+    with span('fetch'):
+        return BytesIO(await image_fetcher.fetch(url, session_manager))
 
 
-def _add_label(img: Image, texts: list, colour: str):
+def _get_circle(circle: Circle) -> Image:
+    """
+    Get a circle image from the sprite atlas, or decode it with the image
+    cache if it is not in the atlas.
+
+    :param circle: the Circle to get the image of.
+    :return: the image, which must not be modified.
+    """
+    img = sprite_atlas.get(circle.sprite)
+    if img is not None:
+        return img
+
+    name = Path(circle.path).name
+    img = image_cache.get(name)
+    if img is None:
+        img = Image.open(circle.path)
+        img.load()
+        image_cache.put(name, img)
+    return img
+
+
+def _add_label(img: Image, texts: tuple, colour: str):
     """
     Adds a label with text to an image.
 
@@ -96,21 +357,36 @@ def _add_label(img: Image, texts: list, colour: str):
     """
     label = _create_label(100, 25, texts, colour, '#000000')
     img = img.convert('RGBA')
-    temp_canvas = Image.new('RGBA', img.size)
 
     img_width, img_height = img.size
     label_width, label_height = label.size
     label_x = int((0.5 * img_width) - (0.5 * label_width)) # Center vertically
     label_y = img_height - label_height
-    temp_canvas.paste(label, (label_x, label_y))
-    return Image.alpha_composite(img, temp_canvas)
+    img.alpha_composite(label, (label_x, label_y))
+    return img
+
+
+@lru_cache(maxsize=None)
+def _get_font(font_type: str, font_size: int) -> ImageFont:
+    """
+    Loads a font, each font and size is only loaded once per process.
+
+    :param font_type: Font file name.
+    :param font_size: Font size.
+
+    :return: Loaded font.
+    """
+    return ImageFont.truetype(font_type, font_size)
 
 
-def _create_label(width: int, height: int, texts: list,
+@lru_cache(maxsize=LABEL_CACHE_SIZE)
+def _create_label(width: int, height: int, texts: tuple,
                  background_colour: str, outline_colour: str) -> Image:
     """
+    Labels are cached, the returned image must not be modified.
+
     :param size: Tuple of (width, height) representing label size.
-    :param texts: List of text to add to the label, each text string will be
+    :param texts: Tuple of text to add to the label, each text string will be
         seperated by a dividing line.
     :param colour: Colour of image.
 
@@ -122,8 +398,7 @@ def _create_label(width: int, height: int, texts: list,
     bounds = [(0, 0), (width-1, height-1)]
     label_draw.rectangle(bounds, background_colour, outline_colour)
 
-    font_size = _compute_label_font_size(label_img, texts, 'arial.ttf')
-    font = ImageFont.truetype('arial.ttf', font_size)
+    font = _get_font(LABEL_FONT, LABEL_FONT_SIZE)
 
     # This made sense when I wrote it.
     container_x, container_y = 0, 0
@@ -152,34 +427,6 @@ def _create_label(width: int, height: int, texts: list,
     return label_img
 
 
-def _compute_label_font_size(label: Image, texts: List, font_type: str) -> int:
-    """
-    Computes the largest possible font size that a label can support for its
-        given text.
-
-    :param label: Target label image.
-    :param texts: List of text to put on the label.
-
-    :return: Largest possible font size.
-    """
-    label_width, label_height = label.size
-
-    text_max_width = label_width / len(texts)
-    text_max_height = label_height
-    max_str = max(texts, key=len)
-
-    font_size = 1
-    font = ImageFont.truetype(font_type, font_size)
-    font_width, font_height = font.getsize(max_str)
-    while font_width < text_max_width and font_height < text_max_height:
-        font_size += 1
-        font = ImageFont.truetype(font_type, font_size)
-        font_width, font_height = font.getsize(max_str)
-
-    #return font_size - 1
-    return 18 # FIXME I'm too tired for this shit right now.
-
-
 def _build_image(circle_images: list, num_rows: int,
                  x_padding: int, y_padding: int, align: bool) -> Image:
     """
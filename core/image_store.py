@@ -0,0 +1,354 @@
+from hashlib import sha1
+from json import dumps, load
+from os import getpid, replace, scandir
+from pathlib import Path
+from posixpath import basename
+from threading import RLock
+from time import time
+from urllib.parse import urlsplit
+from uuid import uuid4
+from zlib import crc32
+
+INDEX_NAME = 'index.json'
+
+# Minimum number of seconds between index saves.
+SAVE_INTERVAL = 60
+
+# Chunk that ends every complete PNG file.
+PNG_END = b'IEND\xaeB`\x82'
+
+
+class ImageStore:
+    """
+    A size bounded image store on disk. Images are addressed by the hash of
+        their name and kept in sharded subdirectories. An index of image
+        sizes, checksums and access times is loaded at startup, the least
+        recently used images are evicted when the store is over its budget.
+
+    Every shard keeps its own index in memory and merges it with the index
+        on disk when saving it. Images written by another process are adopted
+        when they are first read, and entries of images removed by another
+        process are dropped when they are found missing, so the index can be
+        out of date but never causes a wrong image to be served.
+    """
+
+    def __init__(self, root: Path, max_bytes: int):
+        """
+        Constructor for an ImageStore.
+
+        :param root: Directory of the store.
+        :param max_bytes: Maximum total size of all stored images.
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._index = {}
+        self._removed = set()
+        self._dirty = False
+        self._last_save = time()
+        self._lock = RLock()
+
+    def path(self, name: str) -> Path:
+        """
+        Gets the path of an image, the image might not exist.
+
+        :param name: Image file name.
+
+        :return: Path of the image.
+        """
+        shard = sha1(name.encode('utf-8')).hexdigest()[:2]
+        return self.root.joinpath(shard, name)
+
+    def load(self):
+        """
+        Loads the index and reconciles it with the images on disk. If there
+            is no index, images stored directly in the store directory by
+            older versions are moved into the store.
+        """
+        index_path = self.root.joinpath(INDEX_NAME)
+        with self._lock:
+            self._index = _read_index(index_path)
+            if not self._index:
+                self._adopt_flat_files()
+            self._reconcile()
+            self.bytes = sum(entry[0] for entry in self._index.values())
+            self._evict()
+            self.save_index()
+
+    def contains(self, name: str) -> bool:
+        """
+        Checks if an image is stored and marks it as recently used. Images
+            removed by another process are dropped from the index. This does
+            file I/O.
+
+        :param name: Image file name.
+
+        :return: True if the image is stored, otherwise False.
+        """
+        with self._lock:
+            if name in self._index:
+                if self.path(name).exists():
+                    self._touch(name)
+                    return True
+                self.remove(name)
+                return False
+        return self._adopt(name)
+
+    def read(self, name: str) -> bytes:
+        """
+        Reads an image and marks it as recently used. Images failing the
+            integrity check are removed from the store.
+
+        :param name: Image file name.
+
+        :return: Image or None if the image is not stored.
+        """
+        with self._lock:
+            entry = self._index.get(name, None)
+        if entry is None:
+            if not self._adopt(name):
+                return None
+            with self._lock:
+                entry = self._index.get(name, None)
+
+        try:
+            data = self.path(name).read_bytes()
+        except FileNotFoundError:
+            data = None
+
+        if data is None or not _is_valid(data, entry):
+            self.remove(name)
+            return None
+
+        with self._lock:
+            if entry[1] is None:
+                self._set_entry(name, len(data), crc32(data))
+            self._touch(name)
+        return data
+
+    def write(self, name: str, data: bytes):
+        """
+        Writes an image to the store, evicting the least recently used
+            images if the store is over its budget.
+
+        :param name: Image file name.
+        :param data: Image.
+        """
+        path = self.path(name)
+        path.parent.mkdir(exist_ok=True)
+        write_atomic(path, data)
+        with self._lock:
+            self._set_entry(name, len(data), crc32(data))
+            self._evict()
+            self._save_if_due()
+
+    def remove(self, name: str):
+        """
+        Removes an image from the store.
+
+        :param name: Image file name.
+        """
+        with self._lock:
+            entry = self._index.pop(name, None)
+            if entry:
+                self.bytes -= entry[0]
+                self._removed.add(name)
+                self._dirty = True
+        try:
+            self.path(name).unlink()
+        except FileNotFoundError:
+            pass
+
+    def evict(self, max_bytes: int):
+        """
+        Evicts the least recently used images until the store is no larger
+            than a given size.
+
+        :param max_bytes: Size to shrink the store to.
+        """
+        with self._lock:
+            self._evict(max_bytes)
+            self.save_index()
+
+    def save_index(self):
+        """
+        Merges the index with the one on disk, which other shards save to as
+            well, and writes it to disk.
+        """
+        with self._lock:
+            index_path = self.root.joinpath(INDEX_NAME)
+            self._merge_index(_read_index(index_path))
+            self._evict()
+            write_atomic(index_path, dumps(self._index).encode('utf-8'))
+            self._removed.clear()
+            self._dirty = False
+            self._last_save = time()
+
+    def _touch(self, name: str):
+        self._index[name][2] = int(time())
+        self._dirty = True
+        self._save_if_due()
+
+    def _set_entry(self, name: str, size: int, checksum: int):
+        old_entry = self._index.get(name, None)
+        if old_entry:
+            self.bytes -= old_entry[0]
+        # [size, checksum, last access time]
+        self._index[name] = [size, checksum, int(time())]
+        self.bytes += size
+        self._removed.discard(name)
+        self._dirty = True
+
+    def _merge_index(self, saved: dict):
+        """
+        Adds the entries of a saved index that this process did not remove
+            since its last save, keeping the latest access time of entries
+            both indexes have and the checksum of images this process only
+            knows the size of.
+        """
+        for name, entry in saved.items():
+            if name in self._removed:
+                continue
+            current = self._index.get(name, None)
+            if current is None:
+                self._index[name] = entry
+                self.bytes += entry[0]
+            elif current[0] == entry[0] and current[1] is None:
+                current[1] = entry[1]
+                current[2] = max(current[2], entry[2])
+            elif current[:2] == entry[:2] and entry[2] > current[2]:
+                current[2] = entry[2]
+
+    def _adopt(self, name: str) -> bool:
+        """
+        Adds an image that exists on disk but is not in the index.
+        """
+        try:
+            data = self.path(name).read_bytes()
+        except FileNotFoundError:
+            return False
+        if not _is_valid(data, None):
+            return False
+        with self._lock:
+            self._set_entry(name, len(data), crc32(data))
+            self._evict()
+        return True
+
+    def _reconcile(self):
+        """
+        Adds images on disk that are missing from the index, such as images
+            written after the index was last saved, and drops entries of
+            images that are gone. Only file sizes are read, the checksum of
+            an added image is computed when it is first read.
+        """
+        on_disk = {}
+        for shard in scandir(str(self.root)):
+            if not shard.is_dir() or not _is_shard_name(shard.name):
+                continue
+            for entry in scandir(shard.path):
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    on_disk[entry.name] = (stat.st_size, int(stat.st_mtime))
+
+        for name in list(self._index):
+            if name not in on_disk:
+                del self._index[name]
+                self._dirty = True
+        for name, (size, mtime) in on_disk.items():
+            if name not in self._index:
+                # [size, unknown checksum, last access time]
+                self._index[name] = [size, None, mtime]
+                self._dirty = True
+
+    def _adopt_flat_files(self):
+        for path in self.root.iterdir():
+            if not path.is_file() or path.suffix in ('.py', '.json', '.tmp'):
+                continue
+            data = path.read_bytes()
+            if not _is_valid(data, None):
+                path.unlink()
+                continue
+            new_path = self.path(path.name)
+            new_path.parent.mkdir(exist_ok=True)
+            path.replace(new_path)
+            self._set_entry(path.name, len(data), crc32(data))
+
+    def _evict(self, max_bytes: int = None):
+        max_bytes = self.max_bytes if max_bytes is None else max_bytes
+        if self.bytes <= max_bytes:
+            return
+        by_access = sorted(self._index.items(), key=lambda item: item[1][2])
+        for name, entry in by_access:
+            if self.bytes <= max_bytes:
+                break
+            self.remove(name)
+
+    def _save_if_due(self):
+        if self._dirty and time() - self._last_save >= SAVE_INTERVAL:
+            self.save_index()
+
+
+def image_name(url: str) -> str:
+    """
+    Gets the name an image is stored under.
+
+    :param url: url of the image.
+
+    :return: Image file name.
+    """
+    return basename(urlsplit(url).path)
+
+
+def _read_index(index_path: Path) -> dict:
+    """
+    Reads an index from disk.
+
+    :param index_path: Path of the index.
+
+    :return: The index, empty if it is missing or unreadable.
+    """
+    try:
+        with index_path.open(encoding='utf-8') as f:
+            return load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def write_atomic(path: Path, data: bytes):
+    """
+    Write a file through a temporary file so that readers never see a
+        partially written file.
+
+    :param path: path of the file.
+    :param data: file contents.
+    """
+    tmp_path = path.with_name(f'{path.name}.{getpid()}.{uuid4().hex}.tmp')
+    try:
+        tmp_path.write_bytes(data)
+        replace(str(tmp_path), str(path))
+    except OSError:
+        if tmp_path.exists():
+            tmp_path.unlink()
+        raise
+
+
+def _is_shard_name(name: str) -> bool:
+    return len(name) == 2 and all(c in '0123456789abcdef' for c in name)
+
+
+def _is_valid(data: bytes, entry: list) -> bool:
+    """
+    Checks that an image is complete.
+
+    :param data: Image.
+    :param entry: Index entry of the image or None if it has none.
+
+    :return: True if the image passes the integrity check.
+    """
+    if entry and entry[1] is None:
+        return len(data) == entry[0] and _is_valid(data, None)
+    if entry:
+        return len(data) == entry[0] and crc32(data) == entry[1]
+    if data.startswith(b'\x89PNG'):
+        return data.endswith(PNG_END)
+    return len(data) > 0
@@ -0,0 +1,124 @@
+from collections import OrderedDict
+from threading import RLock
+
+
+class LRUCache:
+    """
+    A thread safe least recently used cache bounded by the total size of its
+        values.
+    """
+
+    def __init__(self, max_bytes: int, sizeof=len):
+        """
+        Constructor for a LRUCache.
+
+        :param max_bytes: Maximum total size of all cached values.
+        :param sizeof: Function returning the size of a value in bytes.
+        """
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._sizeof = sizeof
+        self._items = OrderedDict()
+        self._lock = RLock()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key) -> bool:
+        return key in self._items
+
+    def get(self, key, default=None):
+        """
+        Gets a value from the cache and marks it as recently used.
+
+        :param key: Key of the value.
+        :param default: Value returned if the key is not cached.
+
+        :return: Cached value or default.
+        """
+        with self._lock:
+            try:
+                value, _ = self._items[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Adds a value to the cache, evicting the least recently used values if
+            the cache is over its size limit. Values larger than the limit are
+            not cached.
+
+        :param key: Key of the value.
+        :param value: Value to cache.
+        """
+        size = self._sizeof(value)
+        with self._lock:
+            self.pop(key)
+            if size > self.max_bytes:
+                return
+            self._items[key] = (value, size)
+            self.bytes += size
+            self._evict()
+
+    def pop(self, key, default=None):
+        """
+        Removes a value from the cache.
+
+        :param key: Key of the value.
+        :param default: Value returned if the key is not cached.
+
+        :return: Removed value or default.
+        """
+        with self._lock:
+            try:
+                value, size = self._items.pop(key)
+            except KeyError:
+                return default
+            self.bytes -= size
+            return value
+
+    def clear(self):
+        """
+        Removes every value from the cache.
+        """
+        with self._lock:
+            self._items.clear()
+            self.bytes = 0
+
+    def resize(self, max_bytes: int):
+        """
+        Changes the size limit of the cache, evicting values if needed.
+
+        :param max_bytes: New maximum total size of all cached values.
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def stats(self) -> dict:
+        """
+        Gets the cache counters.
+
+        :return: Dictionary of cache counters.
+        """
+        return {
+            'entries': len(self._items),
+            'bytes': self.bytes,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+    def _evict(self):
+        while self.bytes > self.max_bytes:
+            _, (_, evicted_size) = self._items.popitem(last=False)
+            self.bytes -= evicted_size
+            self.evictions += 1
@@ -0,0 +1,106 @@
+from bisect import bisect_right
+from itertools import accumulate
+from random import random
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+RATES = {
+    "regular": {"N": 0.95, "R": 0.05, "SR": 0.00, "SSR": 0.00, "UR": 0.00},
+    "honour": {"N": 0.00, "R": 0.80, "SR": 0.15, "SSR": 0.04, "UR": 0.01},
+    "coupon": {"N": 0.00, "R": 0.00, "SR": 0.80, "SSR": 0.00, "UR": 0.20},
+    "support": {"N": 0.00, "R": 0.60, "SR": 0.30, "SSR": 0.00, "UR": 0.10},
+    "alpaca": {"N": 0.00, "R": 0.85, "SR": 0.15, "SSR": 0.00, "UR": 0.00}
+}
+
+# Rarities in the order they are rolled for, rarest first. Anything past the
+# sum of the rates is an N.
+RARITY_ORDER = ('UR', 'SSR', 'SR', 'R', 'N')
+
+# Batches at least this large are rolled with numpy if it is installed.
+VECTORISE_THRESHOLD = 1000
+# Whether large batches are rolled with numpy.
+VECTORISED = numpy is not None
+
+# Number of rolls drawn at once when simulating, bounds memory use.
+SIMULATION_CHUNK = 1 << 22
+
+
+class RarityRoller:
+    """
+    Rolls rarities using the cumulative distribution of a box's rates.
+    """
+    __slots__ = ('rates', '_cumulative')
+
+    def __init__(self, rates: dict):
+        """
+        Constructor for a RarityRoller.
+
+        :param rates: Dictionary mapping rarities to their rate.
+        """
+        self.rates = rates
+        self._cumulative = tuple(
+            accumulate(rates.get(rarity, 0) for rarity in RARITY_ORDER))
+
+    def roll(self, guaranteed_sr: bool = False) -> str:
+        """
+        Generates a random rarity.
+
+        :param guaranteed_sr: Whether an R roll should be upgraded to an SR.
+
+        :return: rarity represented as a string ('UR', 'SSR', 'SR', 'R', 'N')
+        """
+        rarity = RARITY_ORDER[self._index(random())]
+        if guaranteed_sr and rarity == 'R':
+            return 'SR'
+        return rarity
+
+    def roll_many(self, count: int) -> list:
+        """
+        Generates a batch of random rarities.
+
+        :param count: Number of rarities to roll.
+
+        :return: List of rarities.
+        """
+        if numpy and count >= VECTORISE_THRESHOLD:
+            return [RARITY_ORDER[i] for i in self._roll_indexes(count)]
+        return [RARITY_ORDER[self._index(random())] for _ in range(count)]
+
+    def simulate(self, pulls: int) -> dict:
+        """
+        Rolls a large number of rarities and counts the results.
+
+        :param pulls: Number of rarities to roll.
+
+        :return: Dictionary mapping rarities to the number of times they were
+            rolled.
+        """
+        if not numpy:
+            counts = dict.fromkeys(RARITY_ORDER, 0)
+            for _ in range(pulls):
+                counts[RARITY_ORDER[self._index(random())]] += 1
+            return counts
+
+        totals = numpy.zeros(len(RARITY_ORDER), dtype=numpy.int64)
+        remaining = pulls
+        while remaining > 0:
+            size = min(remaining, SIMULATION_CHUNK)
+            totals += numpy.bincount(
+                self._roll_indexes(size), minlength=len(RARITY_ORDER))
+            remaining -= size
+        return dict(zip(RARITY_ORDER, totals.tolist()))
+
+    def _index(self, roll: float) -> int:
+        return min(bisect_right(self._cumulative, roll), len(RARITY_ORDER) - 1)
+
+    def _roll_indexes(self, count: int):
+        indexes = numpy.searchsorted(
+            self._cumulative, numpy.random.random(count), side='right')
+        return numpy.minimum(indexes, len(RARITY_ORDER) - 1)
+
+
+# Rollers for each box, compiled once.
+ROLLERS = {box: RarityRoller(rates) for box, rates in RATES.items()}
@@ -0,0 +1,57 @@
+from asyncio import Semaphore, get_event_loop
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+
+EXECUTORS = {
+    'thread': ThreadPoolExecutor,
+    'process': ProcessPoolExecutor
+}
+
+
+class RenderPool:
+    """
+    Runs image rendering off the event loop on a thread or process pool.
+        The number of renders waiting for or running on the pool is bounded,
+        further renders wait for a free slot.
+    """
+
+    def __init__(self, kind: str = 'thread', workers: int = 2,
+                 max_pending: int = 16):
+        """
+        Constructor for a RenderPool.
+
+        :param kind: Type of pool to use (thread, process).
+        :param workers: Number of worker threads or processes.
+        :param max_pending: Maximum number of renders queued or running.
+        """
+        if kind not in EXECUTORS:
+            raise ValueError(f'Unknown render executor {kind}')
+        self.kind = kind
+        self.workers = workers
+        self.max_pending = max_pending
+        self._executor = EXECUTORS[kind](max_workers=workers)
+        self._slots = None
+
+    async def run(self, func, *args):
+        """
+        Runs a function on the pool. Functions and arguments must be
+            picklable when using a process pool.
+
+        :param func: Function to run.
+        :param args: Arguments passed to the function.
+
+        :return: Return value of the function.
+        """
+        if self._slots is None:
+            self._slots = Semaphore(self.max_pending)
+        async with self._slots:
+            return await get_event_loop().run_in_executor(
+                self._executor, partial(func, *args))
+
+    def shutdown(self, wait: bool = True):
+        """
+        Shuts down the pool.
+
+        :param wait: Whether to wait for running renders to finish.
+        """
+        self._executor.shutdown(wait=wait)
@@ -1,4 +1,4 @@
-from collections import namedtuple
+from collections import Counter, namedtuple
 from posixpath import basename
 from random import randint, shuffle, uniform
 from time import time
@@ -9,15 +9,9 @@ from discord import User
 from bot import HahaNoUR
 from core.argument_parser import parse_arguments
 from core.image_generator import create_image, get_one_img, \
-    idol_img_path
-
-RATES = {
-    "regular": {"N": 0.95, "R": 0.05, "SR": 0.00, "SSR": 0.00, "UR": 0.00},
-    "honour": {"N": 0.00, "R": 0.80, "SR": 0.15, "SSR": 0.04, "UR": 0.01},
-    "coupon": {"N": 0.00, "R": 0.00, "SR": 0.80, "SSR": 0.00, "UR": 0.20},
-    "support": {"N": 0.00, "R": 0.60, "SR": 0.30, "SSR": 0.00, "UR": 0.10},
-    "alpaca": {"N": 0.00, "R": 0.85, "SR": 0.15, "SSR": 0.00, "UR": 0.00}
-}
+    image_extension
+from core.rarity_roller import RATES, ROLLERS
+from core.tracing import span
 
 
 class ScoutImage(namedtuple('ScoutImage', ('bytes', 'name'))):
@@ -69,8 +63,10 @@ class ScoutHandler:
             self.results = []
             return None
 
-        fname = f'{int(time())}{randint(0, 100)}.png'
-        _bytes = await create_image(self._bot.session_manager, cards, 2)
+        ext = image_extension('scout')
+        fname = f'{int(time())}{randint(0, 100)}.{ext}'
+        _bytes = await create_image(
+            self._bot.session_manager, cards, 2, profile='scout')
         return ScoutImage(_bytes, fname)
 
     async def _handle_solo_scout(self):
@@ -94,9 +90,7 @@ class ScoutHandler:
             url = "https:" + card["card_image"]
 
         fname = basename(urlsplit(url).path)
-        image_path = idol_img_path.joinpath(fname)
-        bytes_ = await get_one_img(
-            url, image_path, self._bot.session_manager)
+        bytes_ = await get_one_img(url, self._bot.session_manager)
         return ScoutImage(bytes_, fname)
 
     async def _scout_cards(self) -> list:
@@ -105,55 +99,60 @@ class ScoutHandler:
 
         :return: cards scouted
         """
-        rarities = []
+        with span('scout.roll'):
+            rarity_counts = self._roll_rarities()
+        scouts = await self._scout_request(rarity_counts)
+        results = []
+
+        for rarity in RATES[self._box].keys():
+            if rarity_counts[rarity] > 0:
+                results += _get_adjusted_scout(
+                    scouts.get(rarity, []), rarity_counts[rarity]
+                )
+
+        self.results = results
+        shuffle(results)
+        return results
+
+    def _roll_rarities(self) -> Counter:
+        """
+        Rolls the rarities of the scouted cards
+
+        :return: Counter of rarities
+        """
+        roller = ROLLERS[self._box]
 
         if self._guaranteed_sr:
-            for r in range(self._count - 1):
-                rarities.append(self._roll_rarity())
+            rarities = roller.roll_many(self._count - 1)
 
-            if rarities.count("R") + rarities.count("N") == self._count - 1:
-                rarities.append(self._roll_rarity(True))
+            if all(rarity in ("R", "N") for rarity in rarities):
+                rarities.append(roller.roll(True))
             else:
-                rarities.append(self._roll_rarity())
+                rarities.append(roller.roll())
 
         # Case where a normal character is selected
         elif (self._box == "regular") \
                 and len(self._args["name"]) > 0:
-            for r in range(self._count):
-                rarities.append("N")
+            rarities = ["N"] * self._count
 
         else:
-            for r in range(self._count):
-                rarities.append(self._roll_rarity())
+            rarities = roller.roll_many(self._count)
 
-        results = []
+        return Counter(rarities)
 
-        for rarity in RATES[self._box].keys():
-            if rarities.count(rarity) > 0:
-                scout = await self._scout_request(
-                    rarities.count(rarity), rarity
-                )
-
-                results += _get_adjusted_scout(
-                    scout, rarities.count(rarity)
-                )
-
-        self.results = results
-        shuffle(results)
-        return results
-
-    async def _scout_request(self, count: int, rarity: str) -> dict:
+    async def _scout_request(self, rarity_counts: dict) -> dict:
         """
-        Scouts a specified number of cards of a given rarity
+        Scouts a specified number of cards of each rarity
 
-        :param rarity: Rarity of all cards in scout
+        :param rarity_counts: Dictionary mapping rarities to the number of
+            cards of that rarity in the scout
 
-        :return: Cards scouted
+        :return: Dictionary mapping rarities to the cards scouted
         """
-        if count == 0:
-            return []
+        rarity_counts = {r: c for r, c in rarity_counts.items() if c > 0}
+        if not rarity_counts:
+            return {}
         params = {
-            'rarity': rarity,
             'is_promo': False,
             'is_special': (self._box == 'support')
         }
@@ -179,41 +178,16 @@ class ScoutHandler:
             elif arg_type == "attribute":
                 params['attribute'] = val
 
-        # Get and return response
-        return await self._bot.db.cards.get_random_cards(params, count)
-
-    def _roll_rarity(self, guaranteed_sr: bool = False) -> str:
-        """
-        Generates a random rarity based on the defined scouting rates
-
-        :param guaranteed_sr: Whether roll should be an SR
-
-        :return: rarity represented as a string ('UR', 'SSR', 'SR', 'R')
-        """
-        roll = uniform(0, 1)
-
-        required_roll = RATES[self._box]['UR']
-        if roll < required_roll:
-            return 'UR'
-
-        required_roll = RATES[self._box]['SSR'] + RATES[self._box]['UR']
-        if roll < required_roll:
-            return 'SSR'
-
-        required_roll = RATES[self._box]['SR'] + RATES[self._box]['SSR']
-        required_roll += RATES[self._box]['UR']
-        if roll < required_roll:
-            return 'SR'
-
-        required_roll = RATES[self._box]['R'] + RATES[self._box]['SR']
-        required_roll += RATES[self._box]['SSR'] + RATES[self._box]['UR']
-        if roll < required_roll:
-            if guaranteed_sr:
-                return 'SR'
-            else:
-                return 'R'
-        else:
-            return 'N'
+        # Sample from the in-memory catalog once it has been loaded.
+        catalog = self._bot.db.cards.catalog
+        if catalog:
+            return {
+                rarity: catalog.get_random_cards(
+                    dict(params, rarity=rarity), count)
+                for rarity, count in rarity_counts.items()
+            }
+        return await self._bot.db.cards.get_random_cards_by_rarity(
+            params, rarity_counts)
 
 
 def _get_adjusted_scout(scout: list, required_count: int) -> list:
@@ -0,0 +1,159 @@
+from collections import namedtuple
+from json import dump, load
+from mmap import ACCESS_READ, mmap
+from os import getpid
+from pathlib import Path
+from threading import Lock
+from time import time
+
+from PIL import Image
+
+ATLAS_INDEX_NAME = 'atlas.json'
+
+# Card image fields packed into the atlas.
+ATLAS_VARIANTS = ('round_card_image', 'round_card_idolized_image')
+
+# Minimum number of seconds between checks for a rebuilt atlas.
+RELOAD_INTERVAL = 60
+
+
+def sprite_key(card_id: int, variant: str) -> str:
+    """
+    Gets the atlas key of a card image.
+
+    :param card_id: ID of the card.
+    :param variant: Card image field, such as 'round_card_image'.
+
+    :return: Atlas key.
+    """
+    return f'{card_id}/{variant}'
+
+
+# An atlas index and the memory map of its atlas file, swapped together so
+# readers never pair an index with another atlas.
+LoadedAtlas = namedtuple('LoadedAtlas', ('sprites', 'map', 'mtime'))
+
+EMPTY_ATLAS = LoadedAtlas({}, None, None)
+
+
+class SpriteAtlas:
+    """
+    Read access to a memory mapped atlas of raw RGBA circle images. Every
+        process maps the same file, so the pages are shared through the OS
+        page cache and no image needs to be decoded.
+
+    Lookups never do file I/O. Rebuilt atlases are picked up by reload,
+        which must be called off the event loop.
+    """
+
+    def __init__(self, root: Path):
+        """
+        Constructor for a SpriteAtlas.
+
+        :param root: Directory containing the atlas files.
+        """
+        self.root = root
+        self._atlas = EMPTY_ATLAS
+        self._last_check = 0
+        self._lock = Lock()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._atlas.sprites
+
+    def get(self, key: str) -> Image:
+        """
+        Gets an image from the atlas. The image shares memory with the atlas
+            and must not be modified.
+
+        :param key: Atlas key of the image.
+
+        :return: Image or None if the image is not in the atlas.
+        """
+        atlas = self._atlas
+        entry = atlas.sprites.get(key, None)
+        if entry is None:
+            return None
+        offset, width, height = entry
+        data = memoryview(atlas.map)[offset:offset + width * height * 4]
+        return Image.frombuffer(
+            'RGBA', (width, height), data, 'raw', 'RGBA', 0, 1)
+
+    def reload_if_due(self):
+        """
+        Reloads the atlas if it was not checked for RELOAD_INTERVAL seconds.
+            This does file I/O.
+        """
+        if time() - self._last_check >= RELOAD_INTERVAL:
+            self.reload()
+
+    def reload(self):
+        """
+        Loads the atlas if it was rebuilt since it was last loaded. This does
+            file I/O.
+        """
+        with self._lock:
+            self._last_check = time()
+            index_path = self.root.joinpath(ATLAS_INDEX_NAME)
+            try:
+                mtime = index_path.stat().st_mtime
+            except FileNotFoundError:
+                self._atlas = EMPTY_ATLAS
+                return
+            if mtime == self._atlas.mtime:
+                return
+            with index_path.open() as f:
+                index = load(f)
+            atlas_map = None
+            if index['sprites']:
+                with self.root.joinpath(index['atlas']).open('rb') as f:
+                    atlas_map = mmap(f.fileno(), 0, access=ACCESS_READ)
+            # Images from an old map keep it alive until they are freed.
+            self._atlas = LoadedAtlas(index['sprites'], atlas_map, mtime)
+
+
+def build_atlas(root: Path, sprites) -> int:
+    """
+    Writes a new atlas, replacing the current one. The atlas being replaced
+        is kept for processes that have not reloaded yet, older ones are
+        removed.
+
+    :param root: Directory to write the atlas files to.
+    :param sprites: Iterable of (atlas key, image) tuples.
+
+    :return: Number of images in the atlas.
+    """
+    root.mkdir(exist_ok=True)
+    atlas_name = f'atlas-{int(time() * 1000)}.rgba'
+    index_path = root.joinpath(ATLAS_INDEX_NAME)
+    tmp_index_path = index_path.with_name(
+        f'{ATLAS_INDEX_NAME}.{getpid()}.tmp')
+
+    try:
+        with index_path.open() as f:
+            current_name = load(f)['atlas']
+    except (OSError, ValueError, KeyError):
+        current_name = None
+
+    index = {}
+    offset = 0
+    with root.joinpath(atlas_name).open('wb') as f:
+        for key, img in sprites:
+            data = img.convert('RGBA').tobytes()
+            f.write(data)
+            index[key] = [offset, img.size[0], img.size[1]]
+            offset += len(data)
+
+    # The index names its atlas file, replacing it switches readers over.
+    with tmp_index_path.open('w') as f:
+        dump({'atlas': atlas_name, 'sprites': index}, f)
+    tmp_index_path.replace(index_path)
+
+    for old_atlas in root.glob('atlas-*.rgba'):
+        if old_atlas.name in (atlas_name, current_name):
+            continue
+        try:
+            old_atlas.unlink()
+        except OSError:
+            # Still mapped by a process on Windows, the next build retries.
+            pass
+    return len(index)
@@ -0,0 +1,77 @@
+from json import dumps
+from time import time
+
+from core.lru_cache import LRUCache
+
+
+def _state_size(entry: tuple) -> int:
+    """
+    Estimates the memory used by a stored state.
+
+    :param entry: Tuple of (expiry time, state).
+
+    :return: Size of the state serialised as JSON, in bytes.
+    """
+    return len(dumps(entry[1]))
+
+
+class MemoryStateStore:
+    """
+    Per process store of small JSON serialisable states, such as a user's
+        album arguments. States expire after a while without use and the
+        least recently used states are evicted when over the memory limit.
+    """
+
+    def __init__(self, ttl: int, max_bytes: int):
+        """
+        Constructor for a MemoryStateStore.
+
+        :param ttl: Seconds after its last use that a state expires.
+        :param max_bytes: Maximum total size of all states, as JSON.
+        """
+        self.ttl = ttl
+        self.expirations = 0
+        self._states = LRUCache(max_bytes, _state_size)
+
+    async def get(self, key: str) -> dict:
+        """
+        Gets a state.
+
+        :param key: Key of the state.
+
+        :return: The state or None if it does not exist or expired.
+        """
+        entry = self._states.get(key)
+        if entry is None:
+            return None
+        expires_at, state = entry
+        if expires_at < time():
+            self._states.pop(key)
+            self.expirations += 1
+            return None
+        return state
+
+    async def put(self, key: str, state: dict):
+        """
+        Stores a state, restarting its expiry time.
+
+        :param key: Key of the state.
+        :param state: JSON serialisable state.
+        """
+        self._states.put(key, (time() + self.ttl, state))
+
+    async def delete(self, key: str):
+        """
+        Removes a state.
+
+        :param key: Key of the state.
+        """
+        self._states.pop(key)
+
+    def stats(self) -> dict:
+        """
+        Gets the store counters.
+
+        :return: Dictionary of store counters.
+        """
+        return dict(self._states.stats(), expirations=self.expirations)
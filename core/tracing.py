@@ -0,0 +1,271 @@
+import json
+import logging
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+from pathlib import Path
+from time import perf_counter, time
+
+# asyncio.current_task was added in Python 3.7.
+try:
+    from asyncio import current_task
+except ImportError:
+    from asyncio import Task
+    current_task = Task.current_task
+
+# Default number of durations kept per command and stage for percentiles.
+TRACE_WINDOW = 1024
+
+# Default number of seconds after which an invocation is a slow trace.
+SLOW_TRACE_SECONDS = 5.0
+
+# Percentiles reported for each command and stage.
+REPORT_PERCENTILES = (50, 90, 99)
+
+# Stage covering a whole invocation.
+TOTAL_STAGE = 'total'
+
+
+class Trace:
+    """
+    Stage durations of one command invocation, in the order they ended.
+        Spans can nest, such as a database call inside another one, so the
+        stages do not have to add up to the total.
+    """
+    __slots__ = ('command', 'started', 'stages')
+
+    def __init__(self, command: str):
+        """
+        Constructor for a Trace.
+
+        :param command: Name of the invoked command.
+        """
+        self.command = command
+        self.started = time()
+        self.stages = []
+
+    def to_dict(self, total: float) -> dict:
+        """
+        Converts the trace to a dictionary to be logged.
+
+        :param total: Duration of the whole invocation in seconds.
+
+        :return: Dictionary of the trace.
+        """
+        return {
+            'command': self.command,
+            'started': self.started,
+            'total': round(total, 4),
+            'stages': [
+                [stage, round(seconds, 4)] for stage, seconds in self.stages
+            ]
+        }
+
+
+class StageTimes:
+    """
+    Rolling window of the latest durations of a stage.
+    """
+    __slots__ = ('durations',)
+
+    def __init__(self, window: int):
+        """
+        Constructor for a StageTimes.
+
+        :param window: Number of durations kept.
+        """
+        self.durations = deque(maxlen=window)
+
+    def add(self, seconds: float):
+        self.durations.append(seconds)
+
+    def percentiles(self, percentiles: tuple) -> tuple:
+        """
+        Gets percentiles of the durations in the window.
+
+        :param percentiles: Percentiles to get, between 0 and 100.
+
+        :return: Tuple of durations in seconds, empty if nothing was
+            recorded.
+        """
+        ordered = sorted(self.durations)
+        if not ordered:
+            return ()
+        last = len(ordered) - 1
+        return tuple(ordered[round(last * p / 100)] for p in percentiles)
+
+
+class Span:
+    """
+    Context manager timing a stage of the current task's trace.
+    """
+    __slots__ = ('tracer', 'stage', 'start')
+
+    def __init__(self, tracer, stage: str):
+        self.tracer = tracer
+        self.stage = stage
+        self.start = None
+
+    def __enter__(self):
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.tracer.record(self.stage, perf_counter() - self.start)
+
+
+class Tracer:
+    """
+    Records stage durations of command invocations. Each invocation is
+        traced on the task running it, so spans anywhere in the coroutines it
+        awaits are added to its trace, and spans outside of a traced task are
+        ignored.
+    """
+
+    def __init__(self, window: int = TRACE_WINDOW,
+                 slow_seconds: float = SLOW_TRACE_SECONDS):
+        """
+        Constructor for a Tracer.
+
+        :param window: Number of durations kept per command and stage.
+        :param slow_seconds: Invocations taking at least this long are
+            written to the slow trace log.
+        """
+        self.window = window
+        self.slow_seconds = slow_seconds
+        self.slow_log = None
+        self.times = {}
+        self._traces = {}
+
+    @contextmanager
+    def trace(self, command: str):
+        """
+        Traces a command invocation on the current task.
+
+        :param command: Name of the invoked command.
+        """
+        task = current_task()
+        if task is None or task in self._traces:
+            yield self._traces.get(task)
+            return
+
+        trace = Trace(command)
+        self._traces[task] = trace
+        start = perf_counter()
+        try:
+            yield trace
+        finally:
+            del self._traces[task]
+            self._finish(trace, perf_counter() - start)
+
+    def span(self, stage: str) -> Span:
+        """
+        Times a stage of the current trace.
+
+        :param stage: Name of the stage.
+
+        :return: Context manager timing the stage.
+        """
+        return Span(self, stage)
+
+    def record(self, stage: str, seconds: float):
+        """
+        Adds a stage that was timed elsewhere, such as on the render pool, to
+            the current trace.
+
+        :param stage: Name of the stage.
+        :param seconds: Duration of the stage.
+        """
+        trace = self._traces.get(current_task())
+        if trace is not None:
+            trace.stages.append((stage, seconds))
+
+    def report(self) -> list:
+        """
+        Formats the percentiles of every command and stage.
+
+        :return: List of report lines, sorted by command and stage.
+        """
+        lines = []
+        for (command, stage), times in sorted(self.times.items()):
+            values = times.percentiles(REPORT_PERCENTILES)
+            percentiles = ' '.join(
+                f'p{p}={value * 1000:.1f}ms'
+                for p, value in zip(REPORT_PERCENTILES, values)
+            )
+            lines.append(
+                f'{command} {stage}: n={len(times.durations)} {percentiles}')
+        return lines
+
+    def _finish(self, trace: Trace, total: float):
+        self._add_time(trace.command, TOTAL_STAGE, total)
+        for stage, seconds in trace.stages:
+            self._add_time(trace.command, stage, seconds)
+        if self.slow_log and total >= self.slow_seconds:
+            self.slow_log.info(json.dumps(trace.to_dict(total)))
+
+    def _add_time(self, command: str, stage: str, seconds: float):
+        key = (command, stage)
+        times = self.times.get(key)
+        if times is None:
+            times = self.times[key] = StageTimes(self.window)
+        times.add(seconds)
+
+
+tracer = Tracer()
+
+
+def configure_tracing(path: Path, slow_seconds: float, window: int):
+    """
+    Sets up the slow trace log and the percentile window.
+
+    :param path: File slow traces are appended to, one JSON object per line.
+    :param slow_seconds: Invocations taking at least this long are logged.
+    :param window: Number of durations kept per command and stage.
+    """
+    slow_log = logging.getLogger('slow_traces')
+    slow_log.propagate = False
+    slow_log.setLevel(logging.INFO)
+    handler = logging.FileHandler(filename=path, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    slow_log.addHandler(handler)
+
+    tracer.slow_log = slow_log
+    tracer.slow_seconds = slow_seconds
+    tracer.window = window
+
+
+def span(stage: str) -> Span:
+    """
+    Times a stage of the current trace.
+
+    :param stage: Name of the stage.
+
+    :return: Context manager timing the stage.
+    """
+    return tracer.span(stage)
+
+
+def record(stage: str, seconds: float):
+    """
+    Adds a stage that was timed elsewhere to the current trace.
+
+    :param stage: Name of the stage.
+    :param seconds: Duration of the stage.
+    """
+    tracer.record(stage, seconds)
+
+
+def traced(stage: str):
+    """
+    Decorator timing every call of a coroutine function as a stage.
+
+    :param stage: Name of the stage.
+    """
+    def decorator(func):
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            with tracer.span(stage):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
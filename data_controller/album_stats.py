@@ -0,0 +1,72 @@
+# Rarities and attributes counted in album stats, in display order.
+STATS_RARITIES = ('N', 'R', 'SR', 'SSR', 'UR')
+STATS_ATTRIBUTES = ('Smile', 'Pure', 'Cool', 'All')
+
+
+def new_album_stats() -> dict:
+    """
+    Creates the stats of an empty album.
+
+    :return: Stats dictionary.
+    """
+    return {
+        'distinct': 0,
+        'total': 0,
+        'unidolized': 0,
+        'idolized': 0,
+        'rarity': {rarity: 0 for rarity in STATS_RARITIES},
+        'attribute': {attribute: 0 for attribute in STATS_ATTRIBUTES}
+    }
+
+
+def count_album_stats(album: list) -> dict:
+    """
+    Counts the stats of an album from scratch. Used to backfill and verify
+        the stats kept up to date by album writes.
+
+    :param album: Album list with merged card information.
+
+    :return: Stats dictionary.
+    """
+    stats = new_album_stats()
+    for card in album:
+        total = card['unidolized_count'] + card['idolized_count']
+        stats['distinct'] += 1
+        stats['total'] += total
+        stats['unidolized'] += card['unidolized_count']
+        stats['idolized'] += card['idolized_count']
+        rarity_counts = stats['rarity']
+        rarity_counts[card['rarity']] = \
+            rarity_counts.get(card['rarity'], 0) + total
+        attribute_counts = stats['attribute']
+        attribute_counts[card['attribute']] = \
+            attribute_counts.get(card['attribute'], 0) + total
+    return stats
+
+
+def add_stats_increments(increments: dict, card: dict, unidolized: int,
+                         idolized: int, distinct: int = 0) -> dict:
+    """
+    Adds a change of an album entry to a $inc document for the stats field
+        of a user, matching what count_album_stats would count.
+
+    :param increments: $inc document to add to.
+    :param card: Card dictionary with rarity and attribute.
+    :param unidolized: Change in unidolized copies.
+    :param idolized: Change in idolized copies.
+    :param distinct: Change in the number of album entries.
+
+    :return: The $inc document.
+    """
+    changes = (
+        ('stats.distinct', distinct),
+        ('stats.total', unidolized + idolized),
+        ('stats.unidolized', unidolized),
+        ('stats.idolized', idolized),
+        ('stats.rarity.' + card['rarity'], unidolized + idolized),
+        ('stats.attribute.' + card['attribute'], unidolized + idolized)
+    )
+    for field, change in changes:
+        if change:
+            increments[field] = increments.get(field, 0) + change
+    return increments
@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+from data_controller.database_controller import DatabaseController
+
+# Seconds after its last refresh that a shard stops being counted.
+SHARD_STATS_EXPIRY = 15 * 60
+
+
+class BotStatsController(DatabaseController):
+    """
+    Keeps global bot counters. Every shard periodically stores its server
+        count in a shared document and reads back the totals, so the cached
+        counters are cheap to read and cover all shards.
+    """
+
+    def __init__(self, mongo_client):
+        """
+        Constructor for a BotStatsController.
+
+        :param mongo_client: Mongo client used by this controller.
+        """
+        super().__init__(mongo_client, 'bot_stats')
+        self.counters = None
+
+    async def refresh(self, shard_id: int, server_count: int,
+                      card_count: int) -> dict:
+        """
+        Stores the counts of a shard and refreshes the cached counters.
+
+        :param shard_id: ID of this shard.
+        :param server_count: Number of servers on this shard.
+        :param card_count: Number of cards.
+
+        :return: Dictionary of counters.
+        """
+        now = datetime.utcnow()
+        await self._collection.update_one(
+            {'_id': f'shard-{shard_id}'},
+            {'$set': {'servers': server_count, 'updated': now}},
+            upsert=True
+        )
+
+        # Shards that stopped refreshing are no longer running.
+        cursor = self._collection.find({
+            '_id': {'$regex': '^shard-'},
+            'updated': {'$gt': now - timedelta(seconds=SHARD_STATS_EXPIRY)}
+        })
+        shards = await cursor.to_list(None)
+
+        self.counters = {
+            'servers': sum(shard['servers'] for shard in shards),
+            'users': await self.mongo_client.users.get_user_count(),
+            'cards': card_count
+        }
+        return self.counters
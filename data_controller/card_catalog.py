@@ -0,0 +1,207 @@
+from random import sample
+
+# Card fields that get an index for fast filtering.
+INDEXED_FIELDS = (
+    'rarity',
+    'attribute',
+    'idol.name',
+    'idol.main_unit',
+    'idol.sub_unit',
+    'idol.year',
+    'is_promo',
+    'is_special'
+)
+
+
+class CardCatalog:
+    """
+    An in-memory copy of the cards collection with precomputed indexes. Used
+        to pick cards for scouts without querying the database.
+    """
+
+    def __init__(self, info_fields: tuple = ()):
+        """
+        Constructor for a CardCatalog.
+
+        :param info_fields: Card fields kept in the records returned by
+            get_card_infos, using Mongo's dot notation.
+        """
+        self.info_fields = info_fields
+        self._cards = {}
+        self._infos = {}
+        self._indexes = {field: {} for field in INDEXED_FIELDS}
+
+    def __len__(self) -> int:
+        return len(self._cards)
+
+    def __contains__(self, card_id: int) -> bool:
+        return card_id in self._cards
+
+    def card_ids(self) -> set:
+        """
+        Gets the IDs of all cards in the catalog.
+
+        :return: Set of card IDs.
+        """
+        return set(self._cards.keys())
+
+    def cards(self) -> list:
+        """
+        Gets every card in the catalog.
+
+        :return: List of card documents.
+        """
+        return list(self._cards.values())
+
+    def load(self, cards: list):
+        """
+        Replaces the contents of the catalog.
+
+        :param cards: List of card documents.
+        """
+        self._cards = {}
+        self._infos = {}
+        self._indexes = {field: {} for field in INDEXED_FIELDS}
+        self.add_cards(cards)
+
+    def add_cards(self, cards: list):
+        """
+        Adds cards to the catalog, replacing any cards with the same ID.
+
+        :param cards: List of card documents.
+        """
+        for card in cards:
+            if card['_id'] in self._cards:
+                self._unindex(self._cards[card['_id']])
+            self._cards[card['_id']] = card
+            self._infos[card['_id']] = card_info(card, self.info_fields)
+            self._index(card)
+
+    def get_card(self, card_id: int) -> dict:
+        """
+        Gets a single card from the catalog.
+
+        :param card_id: ID of card to get.
+
+        :return: Matching card or None if the card does not exist.
+        """
+        return self._cards.get(card_id, None)
+
+    def get_card_infos(self, card_ids: list) -> dict:
+        """
+        Gets the flattened info records of cards, as merged onto album
+            entries. The records are shared and must not be modified.
+
+        :param card_ids: List of card IDs to get.
+
+        :return: Dictionary mapping card IDs to info records. Cards not in
+            the catalog are left out.
+        """
+        infos = self._infos
+        return {
+            card_id: infos[card_id] for card_id in card_ids
+            if card_id in infos
+        }
+
+    def get_random_cards(self, filters: dict, count: int) -> list:
+        """
+        Gets a random list of distinct cards, like a $match followed by a
+            $sample aggregation would.
+
+        :param filters: Dictionary of filters to use. Values can either be a
+            single value or {'$in': [values]}.
+        :param count: Number of results to return.
+
+        :return: Random list of cards.
+        """
+        card_ids = list(self.find_ids(filters))
+        picked = sample(card_ids, min(count, len(card_ids)))
+        return [dict(self._cards[card_id]) for card_id in picked]
+
+    def find_ids(self, filters: dict) -> set:
+        """
+        Finds the IDs of all cards matching a set of filters.
+
+        :param filters: Dictionary of filters to use. Values can either be a
+            single value or {'$in': [values]}.
+
+        :return: Set of matching card IDs.
+        """
+        matches = []
+        for field, value in filters.items():
+            values = value['$in'] if isinstance(value, dict) else [value]
+            if field in self._indexes:
+                index = self._indexes[field]
+                found = set()
+                for val in values:
+                    found.update(index.get(val, ()))
+            else:
+                found = {
+                    card_id for card_id, card in self._cards.items()
+                    if _get_field(card, field) in values
+                }
+            matches.append(found)
+
+        if not matches:
+            return self.card_ids()
+
+        # Intersect starting from the smallest set.
+        matches.sort(key=len)
+        result = set(matches[0])
+        for found in matches[1:]:
+            result.intersection_update(found)
+        return result
+
+    def idol_names(self) -> list:
+        """
+        Gets the names of all idols in the catalog.
+
+        :return: List of idol names.
+        """
+        return [name for name in self._indexes['idol.name'] if name]
+
+    def _index(self, card: dict):
+        for field in INDEXED_FIELDS:
+            index = self._indexes[field]
+            index.setdefault(_get_field(card, field), set()).add(card['_id'])
+
+    def _unindex(self, card: dict):
+        for field in INDEXED_FIELDS:
+            index = self._indexes[field]
+            value = _get_field(card, field)
+            index[value].discard(card['_id'])
+            if not index[value]:
+                del index[value]
+
+
+def card_info(card: dict, fields: tuple) -> dict:
+    """
+    Builds a flattened info record of a card. Nested fields are stored under
+        their last key, so 'idol.name' becomes 'name'.
+
+    :param card: Card document.
+    :param fields: Fields to keep, using Mongo's dot notation.
+
+    :return: Info record including the card's _id.
+    """
+    info = {'_id': card['_id']}
+    for field in fields:
+        info[field.split('.')[-1]] = _get_field(card, field)
+    return info
+
+
+def _get_field(card: dict, field: str):
+    """
+    Gets the value of a possibly nested field using Mongo's dot notation.
+
+    :param card: Card document.
+    :param field: Field name, such as 'idol.name'.
+
+    :return: Field value or None if it does not exist.
+    """
+    value = card
+    for key in field.split('.'):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key, None)
+    return value
@@ -1,14 +1,59 @@
 import copy
+
+from core.tracing import traced
+from data_controller.card_catalog import CardCatalog
 from data_controller.database_controller import DatabaseController
 
+# Card fields joined onto album entries.
+CARD_INFO_FIELDS = {
+    'idol.name': 1,
+    'idol.year': 1,
+    'idol.main_unit': 1,
+    'idol.sub_unit': 1,
+    'rarity': 1,
+    'attribute': 1,
+    'card_image': 1,
+    'release_date': 1,
+    'card_idolized_image': 1,
+    'round_card_image': 1,
+    'round_card_idolized_image': 1
+}
+
+# Card fields kept in the in-memory catalog.
+CATALOG_FIELDS = dict(CARD_INFO_FIELDS, is_promo=1, is_special=1)
+
+
 class CardController(DatabaseController):
     def __init__(self, mongo_client):
         """
-        Constructor for a UserController.
+        Constructor for a CardController.
 
         :param mongo_client: Mongo client used by this controller.
         """
         super().__init__(mongo_client, 'cards')
+        self.catalog = CardCatalog(tuple(CARD_INFO_FIELDS))
+
+    async def load_catalog(self):
+        """
+        Loads every card into the in-memory catalog.
+        """
+        cursor = self._collection.find({}, CATALOG_FIELDS)
+        self.catalog.load(await cursor.to_list(None))
+
+    async def refresh_catalog(self) -> list:
+        """
+        Adds cards that were inserted since the catalog was loaded.
+
+        :return: List of cards added to the catalog.
+        """
+        new_ids = set(await self.get_card_ids()) - self.catalog.card_ids()
+        if not new_ids:
+            return []
+        search = {'_id': {'$in': list(new_ids)}}
+        cursor = self._collection.find(search, CATALOG_FIELDS)
+        cards = await cursor.to_list(None)
+        self.catalog.add_cards(cards)
+        return cards
 
     async def upsert_card(self, card: dict):
         """
@@ -47,22 +92,31 @@ class CardController(DatabaseController):
         :return: Matching cards.
         """
         search = {'_id': {'$in': card_ids}}
-        show = {
-            'idol.name': 1,
-            'idol.year': 1,
-            'idol.main_unit': 1,
-            'idol.sub_unit': 1,
-            'rarity': 1,
-            'attribute': 1,
-            'card_image': 1,
-            'release_date': 1,
-            'card_idolized_image': 1,
-            'round_card_image': 1,
-            'round_card_idolized_image': 1
-        }
-        cursor = self._collection.find(search, show)
+        cursor = self._collection.find(search, CARD_INFO_FIELDS)
         return await cursor.to_list(None)
 
+    @traced('db.get_card_infos')
+    async def get_card_infos(self, card_ids: list) -> dict:
+        """
+        Gets the flattened info records of cards from the catalog. Cards
+            missing from the catalog are loaded into it first.
+
+        :param card_ids: List of card IDs to get.
+
+        :return: Dictionary mapping card IDs to info records. Cards that do
+            not exist are left out.
+        """
+        missing = [
+            card_id for card_id in set(card_ids)
+            if card_id not in self.catalog
+        ]
+        if missing:
+            search = {'_id': {'$in': missing}}
+            cursor = self._collection.find(search, CATALOG_FIELDS)
+            self.catalog.add_cards(await cursor.to_list(None))
+        return self.catalog.get_card_infos(card_ids)
+
+    @traced('db.get_random_cards')
     async def get_random_cards(self, filters: dict, count: int) -> list:
         """
         Gets a random list of cards.
@@ -77,6 +131,27 @@ class CardController(DatabaseController):
         cursor = self._collection.aggregate([match, sample])
         return await cursor.to_list(None)
 
+    @traced('db.get_random_cards_by_rarity')
+    async def get_random_cards_by_rarity(self, filters: dict,
+                                         counts: dict) -> dict:
+        """
+        Gets random lists of cards for several rarities in a single query.
+
+        :param filters: Dicitonary of filters to use, excluding rarity.
+        :param counts: Dictionary mapping rarities to the number of results
+            to return for that rarity.
+
+        :return: Dictionary mapping rarities to random lists of cards.
+        """
+        match = {'$match': dict(filters, rarity={'$in': list(counts)})}
+        facet = {'$facet': {
+            rarity: [{'$match': {'rarity': rarity}}, {'$sample': {'size': n}}]
+            for rarity, n in counts.items()
+        }}
+        cursor = self._collection.aggregate([match, facet])
+        result = await cursor.to_list(None)
+        return result[0] if result else {}
+
     async def get_card_ids(self) -> list:
         """
         Gets a list of all card IDs in the datase.
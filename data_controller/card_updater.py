@@ -7,7 +7,13 @@ from pymongo import MongoClient
 MAX_UPDATE_SIZE = 15
 
 # This is ugly until I find time for a better solution...
-def update_task():
+def update_task(on_update=None):
+    """
+    Periodically inserts new cards from the School Idol Tomodachi API.
+
+    :param on_update: Optional function called with the list of inserted
+        card IDs after each update that inserted cards.
+    """
     while True:
         print('Getting cards...')
         client = None
@@ -28,9 +34,14 @@ def update_task():
                         params={'ids': ','.join(str(i) for i in new_card_ids)})
                 res = json.loads(req.text)
 
+                inserted = []
                 for card in res['results']:
                     if validate_card(card):
                         upsert_card(db, card)
+                        inserted.append(card['id'])
+
+                if inserted and on_update:
+                    on_update(inserted)
 
      
         except Exception as e:
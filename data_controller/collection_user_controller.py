@@ -0,0 +1,341 @@
+import time
+
+from pymongo import UpdateOne
+
+from core.tracing import traced
+from data_controller.album_stats import add_stats_increments
+from data_controller.user_controller import UserController, \
+    get_idolize_pairs, count_new_cards
+
+# Collection holding one album entry per user and card.
+ALBUMS_COLLECTION = 'albums'
+
+# Fields of album entries returned to callers.
+ALBUM_ENTRY_FIELDS = {
+    '_id': 0,
+    'id': 1,
+    'unidolized_count': 1,
+    'idolized_count': 1,
+    'time_aquired': 1
+}
+
+
+class CollectionUserController(UserController):
+    """
+    A UserController that keeps album entries in their own collection, one
+        document per user and card with a unique (user_id, id) index, instead
+        of an array inside the user document. Card updates touch a single
+        small document through the index.
+
+    Album entries and the user document cannot be updated together, so every
+        write is marked as in flight on the user before entries change, and
+        the stats and version are updated when the mark is cleared. Stats are
+        not recounted while a write is in flight. A shard that stops mid
+        write leaves the mark set until scripts/backfill_stats.py
+        --clear-pending is run.
+    """
+
+    def __init__(self, mongo_client):
+        """
+        Constructor for a CollectionUserController.
+
+        :param mongo_client: Mongo client used by this controller.
+        """
+        super().__init__(mongo_client)
+        self._albums = mongo_client.db[ALBUMS_COLLECTION]
+
+    async def create_indexes(self):
+        """
+        Creates the indexes used by this controller.
+        """
+        await super().create_indexes()
+        await self._albums.create_index(
+            [('user_id', 1), ('id', 1)], unique=True)
+
+    async def insert_user(self, user_id: str):
+        """
+        Insert a new user into the database.
+
+        :param user_id: ID of new user.
+        """
+        await self._collection.insert_one({'_id': user_id})
+
+    async def delete_user(self, user_id: str):
+        """
+        Delete a user and their album from the database.
+
+        :param user_id: ID of the user to delete.
+        """
+        await self._albums.delete_many({'user_id': user_id})
+        await self._collection.delete_one({'_id': user_id})
+
+    @traced('db.get_user_album')
+    async def get_user_album(self, user_id: str,
+                             expand_info: bool=False) -> list:
+        """
+        Gets the cards album of a user.
+
+        :param user_id: User ID of the user to query the album from.
+
+        :return: Card album list.
+        """
+        cursor = self._albums.find(
+            {'user_id': user_id}, ALBUM_ENTRY_FIELDS).sort('id', 1)
+        album = await cursor.to_list(None)
+        if expand_info:
+            album = await self._merge_card_info(album)
+
+        return album
+
+    @traced('db.get_card_from_album')
+    async def get_card_from_album(self, user_id: str, card_id: int) -> dict:
+        """
+        Gets a card from a user's album.
+
+        :param user_id: User ID of the user to query the card from.
+
+        :return: Card dictionary or None if card does not exist.
+        """
+        result = await self._albums.find_one(
+            {'user_id': user_id, 'id': card_id}, ALBUM_ENTRY_FIELDS)
+        if not result:
+            return None
+
+        result = await self._merge_card_info([result])
+        return result[0] if result else None
+
+    @traced('db.add_to_user_album')
+    async def add_to_user_album(self, user_id: str, new_cards: list,
+                                idolized: bool = False):
+        """
+        Adds a list of cards to a user's card album, creating the user if they
+            do not exist. Entries are upserted in one bulk write.
+
+        :param user_id: User ID of the user who's album will be added to.
+        :param new_cards: List of dictionaries of new cards to add.
+        :param idolized: Whether the new cards being added are idolized.
+        """
+        time_aquired = int(round(time.time() * 1000))
+        increments = {}
+        requests = []
+        for card_id, (card, uc, ic) in count_new_cards(
+                new_cards, idolized).items():
+            add_stats_increments(increments, card, uc, ic)
+            requests.append(UpdateOne(
+                {'user_id': user_id, 'id': card_id},
+                {
+                    '$inc': {'unidolized_count': uc, 'idolized_count': ic},
+                    '$setOnInsert': {'time_aquired': time_aquired}
+                },
+                upsert=True
+            ))
+
+        await self._begin_update(user_id, upsert=True)
+        try:
+            if requests:
+                result = await self._albums.bulk_write(
+                    requests, ordered=True)
+                if result.upserted_count:
+                    increments['stats.distinct'] = result.upserted_count
+        except Exception:
+            await self._end_update(user_id, None)
+            raise
+        await self._end_update(user_id, increments)
+
+    @traced('db.remove_from_user_album')
+    async def remove_from_user_album(self, user_id: str, card_id: int,
+                                     idolized: bool=False,
+                                     count: int=1) -> bool:
+        """
+        Removes copies of a card from a user's card album.
+
+        :param user_id: User ID of the user who's album will be removed from.
+        :param card_id: ID of the card to remove.
+        :param idolized: Whether the removed copies are idolized.
+        :param count: Number of copies to remove.
+
+        :return: True if a card was deleted successfully, otherwise False.
+        """
+        card_infos = await self.mongo_client.cards.get_card_infos([card_id])
+        count_field = 'idolized_count' if idolized else 'unidolized_count'
+        increments = {}
+        if card_id in card_infos and idolized:
+            add_stats_increments(increments, card_infos[card_id], 0, -count)
+        elif card_id in card_infos:
+            add_stats_increments(increments, card_infos[card_id], -count, 0)
+
+        await self._begin_update(user_id)
+        try:
+            result = await self._albums.update_one(
+                {'user_id': user_id, 'id': card_id},
+                {'$inc': {count_field: -count}}
+            )
+        except Exception:
+            await self._end_update(user_id, None)
+            raise
+        await self._end_update(
+            user_id, increments if result.matched_count else {})
+        return bool(result.matched_count)
+
+    @traced('db.idolize_card')
+    async def idolize_card(self, user_id: str, card_id: int) -> bool:
+        """
+        Turns two unidolized copies of a card into one idolized copy, in a
+            single atomic update that only applies if the user has at least
+            two unidolized copies.
+
+        :param user_id: User ID of the album owner.
+        :param card_id: ID of the card to idolize.
+
+        :return: True if the card was idolized, otherwise False.
+        """
+        card_infos = await self.mongo_client.cards.get_card_infos([card_id])
+        if card_id not in card_infos:
+            return False
+
+        await self._begin_update(user_id)
+        try:
+            result = await self._albums.update_one(
+                {
+                    'user_id': user_id,
+                    'id': card_id,
+                    'unidolized_count': {'$gte': 2}
+                },
+                {'$inc': {'unidolized_count': -2, 'idolized_count': 1}}
+            )
+        except Exception:
+            await self._end_update(user_id, None)
+            raise
+        if not result.modified_count:
+            await self._end_update(user_id, {})
+            return False
+
+        await self._end_update(user_id, add_stats_increments(
+            {}, card_infos[card_id], -2, 1))
+        return True
+
+    @traced('db.idolize_all')
+    async def idolize_all(self, user_id: str, card_ids: list) -> int:
+        """
+        Idolizes every pair of unidolized copies of the given cards in a
+            user's album. The album is read once and all cards are updated in
+            one bulk write, each guarded on still having enough copies.
+
+        :param user_id: User ID of the album owner.
+        :param card_ids: IDs of the cards that can be idolized.
+
+        :return: Number of different cards idolized.
+        """
+        cursor = self._albums.find(
+            {
+                'user_id': user_id,
+                'id': {'$in': card_ids},
+                'unidolized_count': {'$gte': 2}
+            },
+            ALBUM_ENTRY_FIELDS
+        )
+        increments = {}
+        requests = []
+        for card, pairs in get_idolize_pairs(
+                await self._merge_card_info(await cursor.to_list(None)),
+                card_ids):
+            add_stats_increments(increments, card, -pairs * 2, pairs)
+            requests.append(UpdateOne(
+                {
+                    'user_id': user_id,
+                    'id': card['id'],
+                    'unidolized_count': {'$gte': pairs * 2}
+                },
+                {
+                    '$inc': {
+                        'unidolized_count': -pairs * 2,
+                        'idolized_count': pairs
+                    }
+                }
+            ))
+        if not requests:
+            return 0
+
+        await self._begin_update(user_id)
+        try:
+            result = await self._albums.bulk_write(requests, ordered=False)
+        except Exception:
+            await self._end_update(user_id, None)
+            raise
+        if result.modified_count == len(requests):
+            await self._end_update(user_id, increments)
+        elif result.modified_count:
+            # A concurrent idolize got to some cards first, so it is not
+            # known which cards the stats changed by.
+            await self._end_update(user_id, None)
+            await self.recount_album_stats(user_id)
+        else:
+            await self._end_update(user_id, {})
+        return result.modified_count
+
+    async def _user_has_card(self, user_id: str, card_id: int) -> bool:
+        search = await self._albums.find_one(
+            {'user_id': user_id, 'id': card_id}, {'_id': 1})
+        return search is not None
+
+    async def _begin_update(self, user_id: str, upsert: bool = False):
+        """
+        Marks an album write of a user as in flight, before any album entry
+            changes.
+
+        :param user_id: User ID of the album owner.
+        :param upsert: Whether to create the user if they do not exist.
+        """
+        update = {'$inc': {'album_pending': 1}}
+        if upsert:
+            # Stats of new users are complete from the start.
+            update['$setOnInsert'] = {'stats.counted': True}
+        await self._collection.update_one(
+            {'_id': user_id}, update, upsert=upsert)
+
+    async def _end_update(self, user_id: str, increments: dict):
+        """
+        Clears the in flight mark of an album write, after all its album
+            entries changed, bumping the album version and updating the stats.
+
+        :param user_id: User ID of the album owner.
+        :param increments: $inc document for the album stats, None if the
+            change is unknown and the stats must be recounted.
+        """
+        update = {
+            '$inc': dict(increments or {}, album_version=1, album_pending=-1)
+        }
+        if increments is None:
+            update['$set'] = {'stats.counted': False}
+        await self._collection.update_one({'_id': user_id}, update)
+
+    async def _get_album_snapshot(self, user_id: str) -> tuple:
+        """
+        Reads a user's album along with the album version read before it.
+            The album is only consistent with the version if no write was in
+            flight and the version did not change until stats are saved.
+
+        :param user_id: User ID of the album owner.
+
+        :return: Tuple of (album with merged card information, album version,
+            number of album writes in flight).
+        """
+        user_doc = await self._collection.find_one(
+            {'_id': user_id}, {'album_version': 1, 'album_pending': 1}) or {}
+        album = await self.get_user_album(user_id, True)
+        return (album, user_doc.get('album_version', 0),
+                user_doc.get('album_pending', 0))
+
+    def _album_source(self, user_id: str) -> tuple:
+        """
+        Gets where the album entries of a user are aggregated from.
+
+        :param user_id: User ID of the album owner.
+
+        :return: Tuple of (collection, list of aggregation stages that output
+            the user's album entries).
+        """
+        return self._albums, [
+            {'$match': {'user_id': user_id}},
+            {'$project': ALBUM_ENTRY_FIELDS}
+        ]
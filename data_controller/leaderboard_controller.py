@@ -0,0 +1,240 @@
+from collections import OrderedDict
+from datetime import datetime
+from heapq import nlargest
+
+from pymongo import UpdateOne
+
+from core.tracing import traced
+from data_controller.database_controller import DatabaseController
+
+# Leaderboard metrics mapping names to the user stats field they rank by
+# and a description.
+LEADERBOARD_METRICS = OrderedDict((
+    ('unique', ('stats.distinct', 'Unique cards')),
+    ('total', ('stats.total', 'Total cards')),
+    ('ur', ('stats.rarity.UR', 'UR cards')),
+    ('ssr', ('stats.rarity.SSR', 'SSR cards'))
+))
+
+# Number of users kept on each leaderboard.
+LEADERBOARD_SIZE = 10
+
+# Scope of leaderboards covering every user.
+GLOBAL_SCOPE = 'global'
+
+# Number of server members ranked, or leaderboards written, per query when
+# rebuilding server leaderboards.
+RECONCILE_BATCH_SIZE = 1000
+
+
+class LeaderboardController(DatabaseController):
+    """
+    Materialised top user tables for each metric, globally and per server.
+        Album changes move users on their boards right away, a periodic
+        reconciliation rebuilds the boards from the user stats.
+    """
+
+    def __init__(self, mongo_client):
+        """
+        Constructor for a LeaderboardController.
+
+        :param mongo_client: Mongo client used by this controller.
+        """
+        super().__init__(mongo_client, 'leaderboards')
+        self._users = mongo_client.db['users']
+
+    async def create_indexes(self):
+        """
+        Creates the user stats indexes that global reconciliation sorts by.
+        """
+        for field, _ in LEADERBOARD_METRICS.values():
+            await self._users.create_index([(field, -1)])
+
+    @traced('db.get_leaderboard')
+    async def get_leaderboard(self, scope: str, metric: str) -> list:
+        """
+        Gets a leaderboard.
+
+        :param scope: GLOBAL_SCOPE or a server ID.
+        :param metric: Metric from LEADERBOARD_METRICS.
+
+        :return: List of (user ID, value) tuples, highest value first.
+        """
+        board = await self._collection.find_one(
+            {'_id': _board_id(scope, metric)})
+        if not board:
+            return []
+
+        # Concurrent updates of one user can leave a duplicate entry until
+        # the next reconciliation.
+        seen = set()
+        entries = []
+        for entry in board['entries']:
+            if entry['user_id'] not in seen:
+                seen.add(entry['user_id'])
+                entries.append((entry['user_id'], entry['value']))
+        return entries
+
+    async def record_user(self, user_id: str, server_id: str = None):
+        """
+        Moves a user to their current place on the global leaderboards and
+            those of a server, after their album changed.
+
+        :param user_id: ID of the user.
+        :param server_id: ID of the server the change happened in, if any.
+        """
+        stats = await self.mongo_client.users.get_album_stats(user_id)
+        if not stats:
+            return
+
+        scopes = [GLOBAL_SCOPE] + ([server_id] if server_id else [])
+        requests = []
+        for metric, (field, _) in LEADERBOARD_METRICS.items():
+            value = _get_stat({'stats': stats}, field)
+            if not value:
+                continue
+            for scope in scopes:
+                requests += _board_updates(scope, metric, user_id, value)
+
+        if requests:
+            await self._collection.bulk_write(requests, ordered=True)
+
+    async def reconcile_global(self):
+        """
+        Rebuilds the global leaderboards from the user stats, using the stats
+            indexes.
+        """
+        requests = []
+        for metric, (field, _) in LEADERBOARD_METRICS.items():
+            cursor = self._users.find(
+                {'stats.counted': True, field: {'$gt': 0}},
+                {field: 1}
+            ).sort(field, -1).limit(LEADERBOARD_SIZE)
+            entries = [
+                {'user_id': user['_id'], 'value': _get_stat(user, field)}
+                for user in await cursor.to_list(None)
+            ]
+            requests.append(_board_reset(GLOBAL_SCOPE, metric, entries))
+        await self._collection.bulk_write(requests, ordered=False)
+
+    async def reconcile_servers(self, servers: dict):
+        """
+        Rebuilds the leaderboards of many servers from the user stats. The
+            members of each server are ranked by the database, in batches,
+            so only the top users of each batch are read.
+
+        :param servers: Dictionary mapping server IDs to lists of member IDs.
+        """
+        requests = []
+        for server_id, member_ids in servers.items():
+            boards = {metric: [] for metric in LEADERBOARD_METRICS}
+            for i in range(0, len(member_ids), RECONCILE_BATCH_SIZE):
+                top = await self._get_top_users(
+                    member_ids[i:i + RECONCILE_BATCH_SIZE])
+                for metric, entries in top.items():
+                    boards[metric] += entries
+            for metric, entries in boards.items():
+                entries = nlargest(
+                    LEADERBOARD_SIZE, entries, key=lambda e: e['value'])
+                requests.append(_board_reset(server_id, metric, entries))
+
+        for i in range(0, len(requests), RECONCILE_BATCH_SIZE):
+            await self._collection.bulk_write(
+                requests[i:i + RECONCILE_BATCH_SIZE], ordered=False)
+
+    async def _get_top_users(self, user_ids: list) -> dict:
+        """
+        Ranks users by every metric in one aggregation.
+
+        :param user_ids: IDs of the users to rank.
+
+        :return: Dictionary mapping metrics to lists of entries, highest
+            value first.
+        """
+        facets = {
+            metric: [
+                {'$match': {field: {'$gt': 0}}},
+                {'$sort': {field: -1}},
+                {'$limit': LEADERBOARD_SIZE},
+                {'$project': {
+                    '_id': 0, 'user_id': '$_id', 'value': '$' + field
+                }}
+            ]
+            for metric, (field, _) in LEADERBOARD_METRICS.items()
+        }
+        cursor = self._users.aggregate([
+            {'$match': {'_id': {'$in': user_ids}, 'stats.counted': True}},
+            {'$project': {
+                field: 1 for field, _ in LEADERBOARD_METRICS.values()
+            }},
+            {'$facet': facets}
+        ])
+        result = await cursor.to_list(None)
+        return result[0] if result else {}
+
+
+def _board_id(scope: str, metric: str) -> str:
+    return f'{scope}:{metric}'
+
+
+def _board_reset(scope: str, metric: str, entries: list) -> UpdateOne:
+    """
+    Builds the update that replaces the entries of a leaderboard.
+
+    :param scope: GLOBAL_SCOPE or a server ID.
+    :param metric: Metric from LEADERBOARD_METRICS.
+    :param entries: Entries, highest value first.
+
+    :return: Bulk write request.
+    """
+    return UpdateOne(
+        {'_id': _board_id(scope, metric)},
+        {'$set': {'entries': entries, 'updated': datetime.utcnow()}},
+        upsert=True
+    )
+
+
+def _board_updates(scope: str, metric: str, user_id: str,
+                   value: int) -> list:
+    """
+    Builds the updates that move a user to their place on a leaderboard.
+
+    :param scope: GLOBAL_SCOPE or a server ID.
+    :param metric: Metric from LEADERBOARD_METRICS.
+    :param user_id: ID of the user.
+    :param value: The user's current value of the metric.
+
+    :return: List of bulk write requests.
+    """
+    board_id = _board_id(scope, metric)
+    entry = {'user_id': user_id, 'value': value}
+    return [
+        UpdateOne(
+            {'_id': board_id},
+            {'$pull': {'entries': {'user_id': user_id}}},
+            upsert=True
+        ),
+        UpdateOne(
+            {'_id': board_id},
+            {'$push': {'entries': {
+                '$each': [entry],
+                '$sort': {'value': -1},
+                '$slice': LEADERBOARD_SIZE
+            }}}
+        )
+    ]
+
+
+def _get_stat(doc: dict, field: str) -> int:
+    """
+    Gets a stat using Mongo's dot notation.
+
+    :param doc: User document.
+    :param field: Field name, such as 'stats.rarity.UR'.
+
+    :return: The stat or 0 if it was never counted.
+    """
+    value = doc
+    for key in field.split('.'):
+        value = value.get(key, {})
+    return value or 0
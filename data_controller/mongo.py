@@ -1,23 +1,41 @@
 import motor.motor_asyncio
+from data_controller.bot_stats_controller import BotStatsController
 from data_controller.user_controller import UserController
+from data_controller.collection_user_controller import \
+    CollectionUserController
 from data_controller.card_controller import CardController
 from data_controller.feedback_controller import FeedbackController
+from data_controller.leaderboard_controller import LeaderboardController
 from data_controller.server_controller import ServerController
+from data_controller.state_controller import StateController
 
 PORT = 27017
 DATABASE_NAME = "haha-no-ur"
 
+# User controllers for each album storage backend.
+USER_CONTROLLERS = {
+    'embedded': UserController,
+    'collection': CollectionUserController
+}
+
 class MongoClient:
-    def __init__(self):
+    def __init__(self, album_storage: str = 'embedded'):
         """
         Constructor for a MongoClient
+
+        :param album_storage: Where albums are stored, 'embedded' for an
+            array in each user document or 'collection' for the albums
+            collection.
         """
         self.client = motor.motor_asyncio.AsyncIOMotorClient("localhost", PORT)
         self.db = self.client[DATABASE_NAME]
-        self.users = UserController(self)
+        self.users = USER_CONTROLLERS[album_storage](self)
         self.cards = CardController(self)
         self.feedback = FeedbackController(self)
         self.servers = ServerController(self)
+        self.states = StateController(self)
+        self.stats = BotStatsController(self)
+        self.leaderboards = LeaderboardController(self)
 
     def __del__(self):
         """
@@ -1,22 +1,95 @@
+from datetime import timedelta
 from data_controller.database_controller import DatabaseController
 
+# Prefix of servers that did not set one.
+DEFAULT_PREFIX = '!'
+
+# Prefixes changed this long before the last sync are read again, so writes
+# that were in flight during a sync are not missed.
+SYNC_OVERLAP = timedelta(seconds=30)
+
+
 class ServerController(DatabaseController):
     def __init__(self, mongo_client):
         """
-        Constructor for a ServerController.
+        Constructor for a ServerController. Prefixes are cached, servers that
+            were looked up without a custom prefix are cached as using the
+            default prefix.
 
         :param mongo_client: Mongo client used by this controller.
         """
         super().__init__(mongo_client, 'server')
+        self._prefixes = {}
+        self._default_servers = set()
+        self._last_sync = None
+
+    async def create_indexes(self):
+        """
+        Creates the index used to find recently changed prefixes.
+        """
+        await self._collection.create_index('updated')
+
+    async def load_prefixes(self, server_ids: list):
+        """
+        Loads the prefixes of many servers into the cache in one query.
+
+        :param server_ids: IDs of the servers to load.
+        """
+        self._last_sync = await self._get_database_time()
+        cursor = self._collection.find({'_id': {'$in': server_ids}})
+        self._default_servers.update(server_ids)
+        for server in await cursor.to_list(None):
+            self._cache_prefix(server['_id'], server.get('command_prefix'))
+
+    async def sync_prefixes(self):
+        """
+        Updates the cache with prefixes changed by other shards since the
+            last sync. Change times are stamped and compared by the database
+            clock, not the clocks of the shards.
+        """
+        now = await self._get_database_time()
+        search = {}
+        if self._last_sync:
+            search['updated'] = {'$gte': self._last_sync - SYNC_OVERLAP}
+        cursor = self._collection.find(search)
+        self._last_sync = now
+        for server in await cursor.to_list(None):
+            self._cache_prefix(server['_id'], server.get('command_prefix'))
 
     async def set_prefix(self, server_id: str, prefix: str):
         doc = {'_id': server_id}
-        set_prefix = {'$set': {'command_prefix': prefix}}
+        set_prefix = {
+            '$set': {'command_prefix': prefix},
+            '$currentDate': {'updated': True}
+        }
         await self._collection.update(doc, set_prefix, upsert=True)
+        self._cache_prefix(server_id, prefix)
 
     async def get_prefix(self, server_id: str) -> str:
+        prefix = self._prefixes.get(server_id, None)
+        if prefix:
+            return prefix
+        if server_id in self._default_servers:
+            return DEFAULT_PREFIX
+
         server = await self._collection.find_one({'_id': server_id})
-        if server and server['command_prefix']:
-            return server['command_prefix']
-        return '!'
-            
+        self._cache_prefix(
+            server_id, server.get('command_prefix') if server else None)
+        return self._prefixes.get(server_id, DEFAULT_PREFIX)
+
+    async def _get_database_time(self):
+        """
+        Gets the current time of the database server.
+
+        :return: UTC datetime.
+        """
+        result = await self.mongo_client.db.command('isMaster')
+        return result['localTime']
+
+    def _cache_prefix(self, server_id: str, prefix: str):
+        if prefix and prefix != DEFAULT_PREFIX:
+            self._prefixes[server_id] = prefix
+            self._default_servers.discard(server_id)
+        else:
+            self._prefixes.pop(server_id, None)
+            self._default_servers.add(server_id)
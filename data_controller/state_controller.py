@@ -0,0 +1,82 @@
+from datetime import datetime, timedelta
+
+from core.tracing import traced
+from data_controller.database_controller import DatabaseController
+
+
+class StateController(DatabaseController):
+    """
+    Store of small states shared by every shard, such as a user's album
+        arguments. Has the same interface as core.state_store's
+        MemoryStateStore. Expired states are removed by a TTL index.
+    """
+
+    def __init__(self, mongo_client, ttl: int = 1800):
+        """
+        Constructor for a StateController.
+
+        :param mongo_client: Mongo client used by this controller.
+        :param ttl: Seconds after its last use that a state expires.
+        """
+        super().__init__(mongo_client, 'states')
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def create_indexes(self):
+        """
+        Creates the TTL index that removes expired states.
+        """
+        await self._collection.create_index(
+            'expires_at', expireAfterSeconds=0)
+
+    @traced('db.state_get')
+    async def get(self, key: str) -> dict:
+        """
+        Gets a state.
+
+        :param key: Key of the state.
+
+        :return: The state or None if it does not exist or expired.
+        """
+        # The TTL monitor only runs every minute, check expiry as well.
+        doc = await self._collection.find_one(
+            {'_id': key, 'expires_at': {'$gt': datetime.utcnow()}},
+            {'state': 1}
+        )
+        if not doc:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return doc['state']
+
+    @traced('db.state_put')
+    async def put(self, key: str, state: dict):
+        """
+        Stores a state, restarting its expiry time.
+
+        :param key: Key of the state.
+        :param state: State document.
+        """
+        expires_at = datetime.utcnow() + timedelta(seconds=self.ttl)
+        await self._collection.update_one(
+            {'_id': key},
+            {'$set': {'state': state, 'expires_at': expires_at}},
+            upsert=True
+        )
+
+    async def delete(self, key: str):
+        """
+        Removes a state.
+
+        :param key: Key of the state.
+        """
+        await self._collection.delete_one({'_id': key})
+
+    def stats(self) -> dict:
+        """
+        Gets the store counters.
+
+        :return: Dictionary of store counters.
+        """
+        return {'hits': self.hits, 'misses': self.misses}
@@ -1,7 +1,25 @@
+import math
 import time
+from asyncio import sleep
+from collections import OrderedDict
+
+from pymongo import UpdateOne
+
+from core.tracing import traced
+from data_controller.album_stats import add_stats_increments, \
+    count_album_stats
+from data_controller.card_controller import CARD_INFO_FIELDS
 from data_controller.database_controller import DatabaseController
 import pprint
 
+# Attempts at recounting stats before giving up on a busy album.
+RECOUNT_ATTEMPTS = 3
+# Seconds to wait before recounting again while an album write is in flight.
+RECOUNT_RETRY_DELAY = 0.1
+
+# Matches users without an album write in flight.
+NO_PENDING_WRITES = {'$not': {'$gt': 0}}
+
 class UserController(DatabaseController):
     def __init__(self, mongo_client):
         """
@@ -11,8 +29,25 @@ class UserController(DatabaseController):
         """
         super().__init__(mongo_client, 'users')
 
+    async def create_indexes(self):
+        """
+        Creates the indexes of user documents. Interrupted album writes are
+            found by album_pending, the index only holds writes in flight.
+        """
+        await self._collection.create_index(
+            'album_pending',
+            partialFilterExpression={'album_pending': {'$gt': 0}}
+        )
+
     async def get_user_count(self) -> int:
-        return await self._collection.find().count()
+        """
+        Gets the number of users from the collection metadata, without
+            scanning the collection.
+
+        :return: Number of users.
+        """
+        stats = await self.mongo_client.db.command('collstats', 'users')
+        return stats['count']
 
     async def insert_user(self, user_id: str):
         """
@@ -48,6 +83,7 @@ class UserController(DatabaseController):
         """
         return await self._collection.find_one({'_id': user_id})
 
+    @traced('db.get_user_album')
     async def get_user_album(self, user_id: str, expand_info: bool=False) -> list:
         """
         Gets the cards album of a user.
@@ -67,6 +103,244 @@ class UserController(DatabaseController):
   
         return album
 
+    @traced('db.get_album_page')
+    async def get_album_page(self, user_id: str, filters: dict, sort: str,
+                             descending: bool, page: int,
+                             page_size: int) -> tuple:
+        """
+        Gets one page of a user's album with card information merged,
+            filtering, sorting and paginating in the database. Idolized and
+            unidolized copies of a card are separate entries.
+
+        :param user_id: User ID of the user to query the album from.
+        :param filters: Dictionary mapping album fields to lists of allowed
+            values. Empty lists do not filter.
+        :param sort: Album field to sort by or None to keep album order.
+        :param descending: Whether to sort in descending order.
+        :param page: Requested page, clamped to the pages that exist.
+        :param page_size: Number of entries on a page.
+
+        :return: Tuple of (list of entries on the page, number of entries
+            matching the filters, page number returned).
+        """
+        pipeline = self._album_page_pipeline(filters, sort, descending)
+        page = max(page, 0)
+        entries, count = await self._get_album_facet(
+            user_id, pipeline, page * page_size, page_size)
+
+        # Page was past the end, get the last page instead.
+        max_page = max(int(math.ceil(count / page_size)) - 1, 0)
+        if page > max_page:
+            page = max_page
+            entries, count = await self._get_album_facet(
+                user_id, pipeline, page * page_size, page_size)
+        return entries, count, page
+
+    async def _get_album_facet(self, user_id: str, pipeline: list,
+                               skip: int, limit: int) -> tuple:
+        facet = {'$facet': {
+            'page': [{'$skip': skip}, {'$limit': limit}],
+            'count': [{'$count': 'total'}]
+        }}
+        collection, source = self._album_source(user_id)
+        cursor = collection.aggregate(source + pipeline + [facet])
+        result = await cursor.to_list(None)
+        if not result or not result[0]['count']:
+            return [], 0
+        return result[0]['page'], result[0]['count'][0]['total']
+
+    def _album_source(self, user_id: str) -> tuple:
+        """
+        Gets where the album entries of a user are aggregated from.
+
+        :param user_id: User ID of the album owner.
+
+        :return: Tuple of (collection, list of aggregation stages that output
+            the user's album entries).
+        """
+        return self._collection, [
+            {'$match': {'_id': user_id}},
+            {'$unwind': '$album'},
+            {'$replaceRoot': {'newRoot': '$album'}}
+        ]
+
+    def _album_page_pipeline(self, filters: dict, sort: str,
+                             descending: bool) -> list:
+        """
+        Builds the aggregation stages that turn album entries into filtered
+            and sorted album entries with card information.
+
+        :param filters: Dictionary mapping album fields to lists of allowed
+            values.
+        :param sort: Album field to sort by or None.
+        :param descending: Whether to sort in descending order.
+
+        :return: List of aggregation stages.
+        """
+        # Album entry fields plus card fields, with idol fields flattened
+        # like _merge_card_info does.
+        fields = {
+            '_id': '$id',
+            'id': 1,
+            'unidolized_count': 1,
+            'idolized_count': 1,
+            'time_aquired': 1
+        }
+        for card_field in CARD_INFO_FIELDS:
+            fields[card_field.split('.')[-1]] = '$card.' + card_field
+
+        pipeline = [
+            {'$lookup': {
+                'from': 'cards',
+                'localField': 'id',
+                'foreignField': '_id',
+                'as': 'card'
+            }},
+            {'$unwind': '$card'},
+            {'$project': fields}
+        ]
+
+        match = {
+            field: {'$in': values}
+            for field, values in filters.items() if values
+        }
+        if match:
+            pipeline.append({'$match': match})
+
+        # One entry per copy type the user owns, unidolized first.
+        pipeline += [
+            {'$addFields': {'idolized': {'$filter': {
+                'input': [
+                    {'$cond': [
+                        {'$gt': ['$unidolized_count', 0]}, False, None]},
+                    {'$cond': [
+                        {'$gt': ['$idolized_count', 0]}, True, None]}
+                ],
+                'as': 'copy',
+                'cond': {'$ne': ['$$copy', None]}
+            }}}},
+            {'$unwind': '$idolized'}
+        ]
+
+        if not sort:
+            pipeline.append({'$sort': {'id': 1, 'idolized': 1}})
+            return pipeline
+
+        # Entries without a value for the sort go last, in album order.
+        direction = -1 if descending else 1
+        has_value = {'$not': [{'$in': [
+            {'$ifNull': ['$' + sort, None]}, [None, '', 0, False]]}]}
+        pipeline += [
+            {'$addFields': {
+                'sort_has_value': {'$cond': [has_value, 1, 0]},
+                'sort_value': {'$cond': [has_value, '$' + sort, None]},
+                'sort_id': {'$cond': [
+                    has_value, '$id', {'$multiply': ['$id', direction]}]}
+            }},
+            {'$sort': {
+                'sort_has_value': -1,
+                'sort_value': direction,
+                'sort_id': direction,
+                'idolized': 1
+            }},
+            {'$project': {
+                'sort_has_value': 0,
+                'sort_value': 0,
+                'sort_id': 0
+            }}
+        ]
+        return pipeline
+
+    @traced('db.get_album_version')
+    async def get_album_version(self, user_id: str) -> int:
+        """
+        Gets the version of a user's album, which is incremented every time
+            the album changes.
+
+        :param user_id: User ID of the user to query the version from.
+
+        :return: Album version, 0 if the album was never changed.
+        """
+        user_doc = await self._collection.find_one(
+            {'_id': user_id},
+            {'album_version': 1}
+        )
+        if not user_doc:
+            return 0
+        return user_doc.get('album_version', 0)
+
+    @traced('db.get_album_stats')
+    async def get_album_stats(self, user_id: str) -> dict:
+        """
+        Gets the stats of a user's album, as counted by count_album_stats and
+            kept up to date by album writes.
+
+        :param user_id: User ID of the user to query the stats from.
+
+        :return: Stats dictionary or None if the stats were never counted.
+        """
+        user_doc = await self._collection.find_one(
+            {'_id': user_id},
+            {'stats': 1}
+        )
+        if not user_doc or not user_doc.get('stats', {}).get('counted'):
+            return None
+        return user_doc['stats']
+
+    @traced('db.recount_album_stats')
+    async def recount_album_stats(self, user_id: str) -> dict:
+        """
+        Recounts the stats of a user's album from scratch. The stats are only
+            saved if no album write was in flight and the album did not change
+            while counting.
+
+        :param user_id: User ID of the user to recount.
+
+        :return: Stats dictionary, which is not saved if the album kept
+            changing.
+        """
+        for _ in range(RECOUNT_ATTEMPTS):
+            album, version, pending = await self._get_album_snapshot(user_id)
+            stats = count_album_stats(album)
+            stats['counted'] = True
+            if pending:
+                await sleep(RECOUNT_RETRY_DELAY)
+                continue
+
+            # Albums that were never changed have no version field.
+            result = await self._collection.update_one(
+                {
+                    '_id': user_id,
+                    'album_version': {'$in': [version, None]}
+                    if version == 0 else version,
+                    'album_pending': NO_PENDING_WRITES
+                },
+                {'$set': {'stats': stats}}
+            )
+            if result.matched_count:
+                break
+        return stats
+
+    async def _get_album_snapshot(self, user_id: str) -> tuple:
+        """
+        Reads a user's album together with the album version it belongs to.
+            Every album update also increments the version and the stats, so
+            one read of the user document is consistent.
+
+        :param user_id: User ID of the album owner.
+
+        :return: Tuple of (album with merged card information, album version,
+            number of album writes in flight).
+        """
+        user_doc = await self._collection.find_one(
+            {'_id': user_id},
+            {'album': 1, 'album_version': 1, 'album_pending': 1}
+        ) or {}
+        album = await self._merge_card_info(user_doc.get('album', []))
+        return (album, user_doc.get('album_version', 0),
+                user_doc.get('album_pending', 0))
+
+    @traced('db.get_card_from_album')
     async def get_card_from_album(self, user_id: str, card_id: int) -> dict:
         """
         Gets a card from a user's album.
@@ -85,66 +359,75 @@ class UserController(DatabaseController):
         if len(search) > 0 and 'album' in search[0]:
             result =  search[0]['album'][0]
             result = await self._merge_card_info([result])
-            return result[0]
+            return result[0] if result else None
             
         return None
 
+    @traced('db.add_to_user_album')
     async def add_to_user_album(self, user_id: str, new_cards: list,
                                 idolized: bool = False):
         """
-        Adds a list of cards to a user's card album.
+        Adds a list of cards to a user's card album, creating the user if they
+            do not exist. All changes are sent in one ordered bulk write, each
+            update changes the album, its stats and its version together.
 
         :param user_id: User ID of the user who's album will be added to.
         :param new_cards: List of dictionaries of new cards to add.
         :param idolized: Whether the new cards being added are idolized.
         """
-        for card in new_cards:
-            if card['card_image'] == None:
-                idolized = True
-
-            # User does not have this card, push to album
-            if not await self._user_has_card(user_id, card['_id']):
-                uc, ic = 1, 0
-                if idolized:
-                    uc, ic = 0, 1
-
-                new_card = {
-                    'id': card['_id'],
-                    'unidolized_count': uc,
-                    'idolized_count': ic,
-                    'time_aquired': int(round(time.time() * 1000))
+        time_aquired = int(round(time.time() * 1000))
+        requests = []
+
+        new_counts = count_new_cards(new_cards, idolized)
+        for card_id, (card, uc, ic) in new_counts.items():
+            increments = {
+                'album.$.unidolized_count': uc,
+                'album.$.idolized_count': ic,
+                'album_version': 1
+            }
+            add_stats_increments(increments, card, uc, ic)
+            new_card = {
+                'id': card_id,
+                'unidolized_count': 0,
+                'idolized_count': 0,
+                'time_aquired': time_aquired
+            }
+            sort = {'id': 1}
+            insert_card = {'$each': [new_card], '$sort': sort}
+
+            # Push the card if the user does not have it, then increment.
+            requests.append(UpdateOne(
+                {'_id': user_id, 'album.id': {'$ne': card_id}},
+                {
+                    '$push': {'album': insert_card},
+                    '$inc': {'stats.distinct': 1, 'album_version': 1}
                 }
+            ))
+            requests.append(UpdateOne(
+                {'_id': user_id, 'album.id': card_id},
+                {'$inc': increments}
+            ))
+
+        # Create the user before anything else, their stats are complete from
+        # the start.
+        requests.insert(0, UpdateOne(
+            {'_id': user_id},
+            {'$setOnInsert': {'album': [], 'stats.counted': True}},
+            upsert=True
+        ))
+        await self._collection.bulk_write(requests, ordered=True)
 
-                sort = {'id': 1}
-                insert_card = {'$each': [new_card], '$sort': sort}
-
-                await self._collection.update_one(
-                    {'_id': user_id},
-                    {'$push': {'album': insert_card}}
-                )
-
-            # User has this card, increment count
-            else:
-                if idolized:
-                    await self._collection.update(
-                        {'_id': user_id, 'album.id': card['_id']},
-                        {'$inc': {'album.$.idolized_count': 1}}
-                    )
-                else:
-                    await self._collection.update(
-                        {'_id': user_id, 'album.id': card['_id']},
-                        {'$inc': {'album.$.unidolized_count': 1}}
-                    )
-
+    @traced('db.remove_from_user_album')
     async def remove_from_user_album(self, user_id: str, card_id: int,
                                      idolized: bool=False,
                                      count: int=1) -> bool:
         """
-        Adds a list of cards to a user's card album.
+        Removes copies of a card from a user's card album.
 
-        :param user: User ID of the user who's album will be added to.
-        :param new_cards: List of dictionaries of new cards to add.
-        :param idolized: Whether the new cards being added are idolized.
+        :param user_id: User ID of the user who's album will be removed from.
+        :param card_id: ID of the card to remove.
+        :param idolized: Whether the removed copies are idolized.
+        :param count: Number of copies to remove.
 
         :return: True if a card was deleted successfully, otherwise False.
         """
@@ -152,26 +435,89 @@ class UserController(DatabaseController):
         if not card:
             return False
 
-        # Get new counts.
-        new_unidolized_count = card['unidolized_count']
-        new_idolized_count = card['idolized_count']
+        count_field = 'idolized_count' if idolized else 'unidolized_count'
+        increments = {'album.$.' + count_field: -count, 'album_version': 1}
         if idolized:
-            new_idolized_count -= count
+            add_stats_increments(increments, card, 0, -count)
         else:
-            new_unidolized_count -= count
+            add_stats_increments(increments, card, -count, 0)
 
-        # Update values
-        await self._collection.update(
+        await self._collection.update_one(
             {'_id': user_id, 'album.id': card_id},
-            {
-                '$set': {
-                    'album.$.unidolized_count': new_unidolized_count,
-                    'album.$.idolized_count': new_idolized_count
-                }
-            }
+            {'$inc': increments}
         )
         return True
 
+    @traced('db.idolize_card')
+    async def idolize_card(self, user_id: str, card_id: int) -> bool:
+        """
+        Turns two unidolized copies of a card into one idolized copy, in a
+            single atomic update that only applies if the user has at least
+            two unidolized copies.
+
+        :param user_id: User ID of the album owner.
+        :param card_id: ID of the card to idolize.
+
+        :return: True if the card was idolized, otherwise False.
+        """
+        card_infos = await self.mongo_client.cards.get_card_infos([card_id])
+        if card_id not in card_infos:
+            return False
+
+        result = await self._collection.update_one(
+            *self._idolize_update(user_id, card_infos[card_id], 1))
+        return result.modified_count > 0
+
+    @traced('db.idolize_all')
+    async def idolize_all(self, user_id: str, card_ids: list) -> int:
+        """
+        Idolizes every pair of unidolized copies of the given cards in a
+            user's album. The album is read once and all cards are updated in
+            one bulk write, each guarded on still having enough copies.
+
+        :param user_id: User ID of the album owner.
+        :param card_ids: IDs of the cards that can be idolized.
+
+        :return: Number of different cards idolized.
+        """
+        requests = [
+            UpdateOne(*self._idolize_update(user_id, card, pairs))
+            for card, pairs in get_idolize_pairs(
+                await self.get_user_album(user_id, True), card_ids)
+        ]
+        if not requests:
+            return 0
+
+        result = await self._collection.bulk_write(requests, ordered=False)
+        return result.modified_count
+
+    def _idolize_update(self, user_id: str, card: dict,
+                        pairs: int) -> tuple:
+        """
+        Builds the update that idolizes pairs of copies of a card, if the user
+            still has enough unidolized copies.
+
+        :param user_id: User ID of the album owner.
+        :param card: Card dictionary with card information.
+        :param pairs: Number of pairs of copies to idolize.
+
+        :return: Tuple of (filter, update).
+        """
+        increments = {
+            'album.$.unidolized_count': -pairs * 2,
+            'album.$.idolized_count': pairs,
+            'album_version': 1
+        }
+        add_stats_increments(increments, card, -pairs * 2, pairs)
+        search = {
+            '_id': user_id,
+            'album': {'$elemMatch': {
+                'id': card['_id'],
+                'unidolized_count': {'$gte': pairs * 2}
+            }}
+        }
+        return search, {'$inc': increments}
+
     async def _user_has_card(self, user_id: str, card_id: int) -> bool:
         search_filter = {'$elemMatch': {'id': card_id}}
 
@@ -182,27 +528,61 @@ class UserController(DatabaseController):
 
         return len(search.keys()) > 1
 
+    @traced('db.merge_card_info')
     async def _merge_card_info(self, album: list) -> list:
         """
         Merges card information to an album.
 
         :param album: Album list.
-        :param card_infos: Card information to join.
 
-        :return: New list of card dictionaries with merged information.
+        :return: List of card dictionaries with merged information. Cards
+            that no longer exist are left out.
         """
         card_ids = [card['id'] for card in album]
-        card_infos = await self.mongo_client.cards.get_cards(card_ids)
+        card_infos = await self.mongo_client.cards.get_card_infos(card_ids)
+
+        merged = []
+        for card in album:
+            card_info = card_infos.get(card['id'], None)
+            if card_info is not None:
+                card.update(card_info)
+                merged.append(card)
+
+        return merged
+
+
+def count_new_cards(new_cards: list, idolized: bool = False) -> OrderedDict:
+    """
+    Groups cards being added to an album by card ID. Cards without an
+        unidolized image are always added as idolized.
+
+    :param new_cards: List of dictionaries of new cards to add.
+    :param idolized: Whether the new cards being added are idolized.
+
+    :return: Ordered dictionary mapping card IDs to
+        [card, unidolized count, idolized count].
+    """
+    counts = OrderedDict()
+    for card in new_cards:
+        card_counts = counts.setdefault(card['_id'], [card, 0, 0])
+        if idolized or card['card_image'] == None:
+            card_counts[2] += 1
+        else:
+            card_counts[1] += 1
+    return counts
 
-        if len(album) != len(card_infos):
-            return []
 
-        for i in range(0, len(album)):
-            for key in card_infos[i]:
-                if key == 'idol':
-                    for idol_key in card_infos[i][key]:
-                        album[i][idol_key] = card_infos[i][key][idol_key]
-                else:
-                    album[i][key] = card_infos[i][key]
+def get_idolize_pairs(album: list, card_ids: list):
+    """
+    Finds the album entries that have unidolized copies to idolize.
+
+    :param album: Album list.
+    :param card_ids: IDs of the cards that can be idolized.
 
-        return album
\ No newline at end of file
+    :return: Generator of (album entry, number of copies to idolize).
+    """
+    card_ids = set(card_ids)
+    for card in album:
+        pairs = card['unidolized_count'] // 2
+        if pairs > 0 and card['id'] in card_ids:
+            yield card, pairs
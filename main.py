@@ -1,6 +1,7 @@
 '''
 A discord bot for scouting in Love Live: School Idol Festival.
 '''
+import logging
 import sys
 from asyncio import get_event_loop
 from json import load
@@ -10,7 +11,18 @@ from threading import Thread
 from commands import *
 from bot import HahaNoUR, get_session_manager
 from bot.logger import setup_logging
+from commands.album_commands import ALBUM_PAGE_CACHE_BYTES, \
+    ALBUM_STATE_BYTES, ALBUM_STATE_TTL, configure_album_page_cache, \
+    configure_album_state
 from config import config_path
+from core.image_generator import IMAGE_CACHE_BYTES, IMAGE_STORE_BYTES, \
+    configure_encoders, configure_image_cache, configure_image_fetcher, \
+    configure_image_store, configure_render_pool, encode_counters, \
+    image_cache
+from core.rarity_roller import VECTORISED
+from core.state_store import MemoryStateStore
+from core.tracing import SLOW_TRACE_SECONDS, TRACE_WINDOW, \
+    configure_tracing
 from data_controller.mongo import MongoClient
 from logs import log_path
 from data_controller.card_updater import update_task
@@ -46,6 +58,8 @@ def main():
 
     start_time = int(time())
     logger = setup_logging(start_time, log_path)
+    logger.log(logging.INFO, 'Large rarity batches are rolled with ' + (
+        'numpy' if VECTORISED else 'python, numpy is not installed'))
     loop = get_event_loop()
     session_manager = loop.run_until_complete(get_session_manager(logger))
 
@@ -54,25 +68,69 @@ def main():
     with config_path.joinpath('auth.json').open() as f:
         auth = load(f)
 
-    db = MongoClient() if config.get('mongo', True) else None
+    db = MongoClient(config.get('album_storage', 'embedded')) \
+        if config.get('mongo', True) else None
+    configure_image_cache(
+        config.get('image_cache_bytes', IMAGE_CACHE_BYTES))
+    configure_render_pool(
+        config.get('render_executor', 'thread'),
+        config.get('render_workers', 2),
+        config.get('render_queue_size', 16)
+    )
+    configure_encoders(config.get('encoders', {}))
+    configure_image_store(
+        config.get('image_store_bytes', IMAGE_STORE_BYTES))
+    configure_image_fetcher(config.get('fetch_per_host', 4))
+    configure_album_page_cache(
+        config.get('album_page_cache_bytes', ALBUM_PAGE_CACHE_BYTES))
+    configure_tracing(
+        log_path.joinpath(f'{start_time}-slow.log'),
+        config.get('slow_trace_seconds', SLOW_TRACE_SECONDS),
+        config.get('trace_window', TRACE_WINDOW)
+    )
+
+    # Album arguments are shared by every shard when stored in Mongo.
+    album_state_ttl = config.get('album_state_ttl', ALBUM_STATE_TTL)
+    if db and config.get('album_state', 'memory') == 'mongo':
+        db.states.ttl = album_state_ttl
+        album_state = db.states
+    else:
+        album_state = MemoryStateStore(
+            album_state_ttl,
+            config.get('album_state_bytes', ALBUM_STATE_BYTES)
+        )
+    configure_album_state(album_state)
 
     bot = HahaNoUR(
         config['default_prefix'], start_time, int(config['colour'], base=16),
         logger, session_manager, db, auth['error_log'], auth['feedback_log'],
-        shard, shard_count
+        shard, shard_count, config
     )
 
+    # Render worker processes have their own image cache, its counters are
+    # only reported when rendering on threads.
+    bot.add_counters('Image cache', image_cache.stats)
+    bot.add_counters('Encoders', encode_counters)
+    bot.add_counters('Album state', album_state.stats)
+
     bot.remove_command('help')
     cogs = [
         Scout(bot), 
         Album(bot), 
         Info(bot), 
         Stats(bot), 
-        Config(bot)
+        Config(bot),
+        Leaderboard(bot)
     ]
 
     if shard == 0:
-        card_update_thread = Thread(target=update_task)
+        def on_update(card_ids):
+            # Called from the updater thread, refresh on the bot's loop.
+            if db:
+                loop.call_soon_threadsafe(
+                    lambda: loop.create_task(bot.update_catalog()))
+
+        card_update_thread = Thread(target=update_task, args=(on_update,))
         card_update_thread.setDaemon(True)
         card_update_thread.start()
 
@@ -0,0 +1,169 @@
+"""
+Counts the album stats of every user from scratch.
+
+Stats are kept up to date by album writes once counted, and !mystats counts
+them on first use. This fills them in ahead of time, or with --verify only
+compares the stored stats against a full recount. Stats are only saved if no
+album write was in flight and the album did not change while counting, users
+whose album is busy are skipped.
+
+With --clear-pending, album writes left marked as in flight by a crashed
+shard are cleared first. Only use it while the bot is stopped.
+
+Run from the project root:
+    python -m scripts.backfill_stats [--verify] [--clear-pending]
+"""
+import sys
+from json import load
+from time import sleep
+
+from pymongo import MongoClient
+
+from config import config_path
+from data_controller.album_stats import count_album_stats
+from data_controller.collection_user_controller import ALBUMS_COLLECTION
+from data_controller.mongo import DATABASE_NAME, PORT
+
+# Attempts at counting a user's stats before skipping a busy album.
+COUNT_ATTEMPTS = 3
+# Seconds to wait before counting again while an album write is in flight.
+RETRY_DELAY = 0.1
+
+# Matches users without an album write in flight.
+NO_PENDING_WRITES = {'$not': {'$gt': 0}}
+
+
+def get_album(db, album_storage: str, user: dict, card_infos: dict) -> list:
+    """
+    Gets a user's album with the card fields that stats are counted by.
+
+    :param db: Database to read from.
+    :param album_storage: Where albums are stored (embedded, collection).
+    :param user: User document.
+    :param card_infos: Dictionary mapping card IDs to card information.
+
+    :return: Album list, without cards that no longer exist.
+    """
+    if album_storage == 'collection':
+        album = db[ALBUMS_COLLECTION].find({'user_id': user['_id']})
+    else:
+        album = user.get('album', [])
+    return [
+        dict(card, **card_infos[card['id']])
+        for card in album if card['id'] in card_infos
+    ]
+
+
+def count_user(db, album_storage: str, user_id: str,
+               card_infos: dict) -> tuple:
+    """
+    Counts a user's stats, retrying if their album changes meanwhile.
+
+    :param db: Database to read from.
+    :param album_storage: Where albums are stored (embedded, collection).
+    :param user_id: ID of the user to count.
+    :param card_infos: Dictionary mapping card IDs to card information.
+
+    :return: Tuple of (counted stats or None, stored stats or None, album
+        version the count is for).
+    """
+    for _ in range(COUNT_ATTEMPTS):
+        user = db['users'].find_one({'_id': user_id})
+        if user.get('album_pending'):
+            sleep(RETRY_DELAY)
+            continue
+        version = user.get('album_version', 0)
+        album = get_album(db, album_storage, user, card_infos)
+        current = db['users'].find_one({'_id': user_id})
+        if current.get('album_version', 0) == version \
+                and not current.get('album_pending'):
+            stats = count_album_stats(album)
+            stats['counted'] = True
+            return stats, user.get('stats', None), version
+    return None, None, None
+
+
+def flatten_stats(stats: dict) -> dict:
+    """
+    Flattens stats for comparison. Counters that were never incremented are
+        missing from stored stats, so zero counts are left out.
+
+    :param stats: Stats dictionary.
+
+    :return: Dictionary mapping dotted stat names to non zero counts.
+    """
+    flat = {}
+    for name, value in (stats or {}).items():
+        if isinstance(value, dict):
+            for key, count in flatten_stats(value).items():
+                flat[name + '.' + key] = count
+        elif value:
+            flat[name] = value
+    return flat
+
+
+def main():
+    verify = '--verify' in sys.argv[1:]
+    clear_pending = '--clear-pending' in sys.argv[1:]
+    with config_path.joinpath('config.json').open() as f:
+        config = load(f)
+    album_storage = config.get('album_storage', 'embedded')
+
+    client = MongoClient('localhost', PORT)
+    db = client[DATABASE_NAME]
+    if clear_pending:
+        result = db['users'].update_many(
+            {'album_pending': {'$gt': 0}},
+            {
+                '$set': {'album_pending': 0, 'stats.counted': False},
+                '$inc': {'album_version': 1}
+            }
+        )
+        print(f'{result.modified_count} interrupted album writes cleared')
+    card_infos = {
+        card['_id']: {'rarity': card['rarity'], 'attribute': card['attribute']}
+        for card in db['cards'].find({}, {'rarity': 1, 'attribute': 1})
+    }
+
+    user_ids = db['users'].find().distinct('_id')
+    total = len(user_ids)
+    mismatched = uncounted = skipped = 0
+    for i, user_id in enumerate(user_ids, 1):
+        stats, stored, version = count_user(
+            db, album_storage, user_id, card_infos)
+        if stats is None:
+            skipped += 1
+            continue
+
+        if verify:
+            if not stored or not stored.get('counted'):
+                uncounted += 1
+            elif flatten_stats(stored) != flatten_stats(stats):
+                mismatched += 1
+                print(f'{user_id}: stored {stored}, counted {stats}')
+            continue
+
+        # Albums that were never changed have no version field.
+        result = db['users'].update_one(
+            {
+                '_id': user_id,
+                'album_version': {'$in': [version, None]}
+                if version == 0 else version,
+                'album_pending': NO_PENDING_WRITES
+            },
+            {'$set': {'stats': stats}}
+        )
+        if not result.matched_count:
+            skipped += 1
+        print(f'{i}/{total}')
+
+    client.close()
+    if verify:
+        print(f'done, {mismatched}/{total} users have wrong stats, '
+              f'{uncounted} were never counted, {skipped} busy users skipped')
+    else:
+        print(f'done, {skipped} busy users skipped, run again to count them')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,119 @@
+"""
+Measures how many messages per second a shard can check for commands, on a
+message mix where most messages are chat. Compares the command dispatcher
+against splitting every message, as process_commands used to.
+
+Command callbacks are not run, only prefix handling and command lookup.
+
+Run from the project root:
+    python -m scripts.benchmark_dispatch [messages]
+"""
+import random
+import sys
+from time import perf_counter
+
+from bot.dispatcher import CommandDispatcher
+
+# Bot prefix used by the benchmark.
+PREFIX = '!'
+
+# Commands and aliases registered in the benchmark bot.
+COMMAND_NAMES = (
+    'scout', 's', 'scout11', 's11', 'scoutr', 'sr', 'album', 'a', 'idolize',
+    'mystats', 'botstats', 'leaderboard', 'lb', 'help', 'prefix',
+    'resetprefix', 'feedback', 'info'
+)
+
+# Share of messages sent in servers with a custom prefix.
+CUSTOM_PREFIX_SHARE = 0.1
+
+# Message mix as (share, message templates), {} is replaced by the prefix.
+MESSAGE_MIX = (
+    (0.80, (
+        'hello everyone', 'lol', 'did anyone get the new UR?',
+        'what time is the event over',
+        'I have been scouting for weeks and still no Kotori ;-;',
+        ':sob:', 'https://example.com/some/link.png', 'gn'
+    )),
+    (0.05, ('{}', '{}!', '{} what', '!?', '{}notacommand')),
+    (0.15, (
+        '{}scout', '{}s11 honoka', '{}scoutr aqours', '{}album',
+        '{}album page 2 sort rarity', '{}a filter UR', '{}mystats',
+        '{}lb unique', '{}help scout'
+    ))
+)
+
+
+class BenchmarkBot:
+    def __init__(self):
+        self.commands = {name: name for name in COMMAND_NAMES}
+
+
+def get_messages(count: int) -> list:
+    """
+    Generates a message mix.
+
+    :param count: number of messages.
+
+    :return: List of (message content, server prefix) tuples.
+    """
+    rng = random.Random(0)
+    shares = [share for share, _ in MESSAGE_MIX]
+    messages = []
+    for _ in range(count):
+        templates = rng.choices(MESSAGE_MIX, shares)[0][1]
+        prefix = '?' if rng.random() < CUSTOM_PREFIX_SHARE else PREFIX
+        messages.append((rng.choice(templates).format(prefix), prefix))
+    return messages
+
+
+def split_match(commands: dict, content: str, prefix: str):
+    """
+    Checks a message for a command by splitting it, as process_commands
+        did before the dispatcher.
+    """
+    if content.startswith(prefix):
+        content = PREFIX + content[len(prefix):]
+    elif content.startswith(PREFIX) and PREFIX != prefix:
+        content = content[1:]
+    if content.split(' ')[0].startswith('resetprefix'):
+        content = PREFIX + 'resetprefix'
+    is_cmd = content[0] == PREFIX
+    command_name = content.split(' ')[0][len(PREFIX):]
+    if is_cmd and command_name in list(commands.keys()):
+        return commands[command_name]
+    return None
+
+
+def run(name: str, match, messages: list) -> int:
+    """
+    Runs a benchmark and prints its throughput.
+
+    :param name: name of the benchmark.
+    :param match: function taking message content and a prefix.
+    :param messages: the message mix.
+
+    :return: Number of commands matched.
+    """
+    start = perf_counter()
+    matched = sum(
+        1 for content, prefix in messages if match(content, prefix))
+    elapsed = perf_counter() - start
+    print(f'{name}: {len(messages) / elapsed:,.0f} messages/s, '
+          f'{matched} commands')
+    return matched
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    messages = get_messages(count)
+    bot = BenchmarkBot()
+    dispatcher = CommandDispatcher(bot, PREFIX)
+    dispatcher.rebuild()
+
+    run('split', lambda c, p: split_match(bot.commands, c, p), messages)
+    run('dispatcher', dispatcher.match, messages)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Packs every round card image in the image store into the sprite atlas.
+Images that have not been downloaded yet are skipped, rebuild the atlas
+after new cards have been prefetched. The image store index is left to the
+running shards, images are read from disk directly.
+
+Run from the project root:
+    python -m scripts.build_atlas
+"""
+from io import BytesIO
+from json import load
+
+from PIL import Image
+from pymongo import MongoClient
+
+from config import config_path
+from core.image_store import ImageStore, image_name
+from core.sprite_atlas import ATLAS_VARIANTS, build_atlas, sprite_key
+from idol_images import idol_img_path
+
+# Default size budget of the image store, matches core.image_generator.
+IMAGE_STORE_BYTES = 4 * 1024 * 1024 * 1024
+
+
+def get_sprites(cards, store: ImageStore, missing: list):
+    """
+    Decodes the round images of cards.
+
+    :param cards: Iterable of card documents.
+    :param store: Store to read images from, its index is not used.
+    :param missing: List that atlas keys of images not in the store or not
+        readable are added to.
+
+    :return: Generator of (atlas key, image) tuples.
+    """
+    for card in cards:
+        for variant in ATLAS_VARIANTS:
+            if not card.get(variant):
+                continue
+            key = sprite_key(card['_id'], variant)
+            path = store.path(image_name('http:' + card[variant]))
+            try:
+                img = Image.open(BytesIO(path.read_bytes()))
+                img.load()
+            except OSError:
+                missing.append(key)
+                continue
+            yield key, img
+
+
+def main():
+    with config_path.joinpath('config.json').open() as f:
+        config = load(f)
+    store = ImageStore(
+        idol_img_path, config.get('image_store_bytes', IMAGE_STORE_BYTES))
+
+    client = MongoClient('localhost', 27017)
+    cards = client['haha-no-ur']['cards'].find(
+        {}, {variant: 1 for variant in ATLAS_VARIANTS})
+
+    missing = []
+    count = build_atlas(
+        idol_img_path.joinpath('atlas'), get_sprites(cards, store, missing))
+    client.close()
+    print(f'{count} images packed, {len(missing)} not downloaded yet')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+Moves album arrays out of user documents into the albums collection.
+
+The migration is online. Switch the bot to "album_storage": "collection"
+first, so new scouts already create-or-increment entries in the albums
+collection, then run this while the bot is up. Each user's array is taken
+atomically and added onto their entries, so cards scouted during the
+migration are kept. Users not migrated yet only see cards scouted since
+the switch until the script reaches them.
+
+Run from the project root:
+    python -m scripts.migrate_albums
+"""
+from pymongo import ASCENDING, MongoClient, ReturnDocument, UpdateOne
+
+from data_controller.collection_user_controller import ALBUMS_COLLECTION
+from data_controller.mongo import DATABASE_NAME, PORT
+
+
+def migrate_user(users, albums, user_id: str) -> int:
+    """
+    Moves one user's album array into the albums collection.
+
+    :param users: Users collection.
+    :param albums: Albums collection.
+    :param user_id: ID of the user to migrate.
+
+    :return: Number of album entries moved.
+    """
+    # Renaming hides the array from further migration runs, and keeps it
+    # for recovery until its entries are written.
+    user = users.find_one_and_update(
+        {'_id': user_id, 'album': {'$exists': True}},
+        {'$rename': {'album': 'migrated_album'}},
+        projection={'migrated_album': 1},
+        return_document=ReturnDocument.AFTER
+    )
+    if not user:
+        return 0
+
+    requests = [
+        UpdateOne(
+            {'user_id': user_id, 'id': card['id']},
+            {
+                '$inc': {
+                    'unidolized_count': card['unidolized_count'],
+                    'idolized_count': card['idolized_count']
+                },
+                '$min': {'time_aquired': card['time_aquired']}
+            },
+            upsert=True
+        )
+        for card in user['migrated_album']
+    ]
+    if requests:
+        albums.bulk_write(requests, ordered=False)
+
+    users.update_one(
+        {'_id': user_id},
+        {'$unset': {'migrated_album': 1}, '$inc': {'album_version': 1}}
+    )
+    return len(requests)
+
+
+def main():
+    client = MongoClient('localhost', PORT)
+    db = client[DATABASE_NAME]
+    users, albums = db['users'], db[ALBUMS_COLLECTION]
+    albums.create_index(
+        [('user_id', ASCENDING), ('id', ASCENDING)], unique=True)
+
+    # Users left over from an interrupted run need to be checked by hand,
+    # their entries may already be partially written.
+    interrupted = users.find({'migrated_album': {'$exists': True}}).distinct(
+        '_id')
+    for user_id in interrupted:
+        print(f'Skipping interrupted user {user_id}')
+
+    user_ids = users.find({'album': {'$exists': True}}).distinct('_id')
+    total = len(user_ids)
+    entries = 0
+    for i, user_id in enumerate(user_ids, 1):
+        entries += migrate_user(users, albums, user_id)
+        print(f'{i}/{total}')
+
+    client.close()
+    print(f'done, {entries} album entries moved')
+
+
+if __name__ == '__main__':
+    main()
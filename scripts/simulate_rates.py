@@ -0,0 +1,91 @@
+"""
+Simulates a large number of scouts for every box and audits the rates
+published in the scout command docstrings against RATES.
+
+Run from the project root:
+    python -m scripts.simulate_rates [pulls]
+"""
+import ast
+import re
+import sys
+from pathlib import Path
+from time import perf_counter
+
+from core.rarity_roller import RATES, RARITY_ORDER, ROLLERS
+
+SCOUT_COMMANDS = Path(__file__).parent.parent.joinpath(
+    'commands', 'scout_commands.py')
+RATE_PATTERN = re.compile(r'(N|R|SR|SSR|UR): (\d+(?:\.\d+)?)%')
+
+# Allowed difference between a published and a simulated rate.
+TOLERANCE = 0.001
+
+
+def get_published_rates() -> dict:
+    """
+    Reads the rates published in the scout command docstrings.
+
+    :return: Dictionary mapping box names to a dictionary of rates.
+    """
+    tree = ast.parse(SCOUT_COMMANDS.read_text(encoding='utf-8'))
+    published = {}
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.AsyncFunctionDef):
+            continue
+        doc = ast.get_docstring(node) or ''
+        box = _get_box(node)
+        if box and '**Rates:**' in doc:
+            rates = {r: float(p) / 100 for r, p in RATE_PATTERN.findall(doc)}
+            published[box] = rates
+    return published
+
+
+def _get_box(node) -> str:
+    """
+    Gets the box argument passed to ScoutHandler in a command.
+
+    :param node: Function definition node of the command.
+
+    :return: Box name or None.
+    """
+    for call in ast.walk(node):
+        if isinstance(call, ast.Call) and getattr(
+                call.func, 'id', None) == 'ScoutHandler':
+            box = call.args[2]
+            return getattr(box, 'value', getattr(box, 's', None))
+    return None
+
+
+def main():
+    pulls = int(sys.argv[1]) if len(sys.argv) > 1 else 10 ** 7
+    published = get_published_rates()
+    ok = True
+
+    for box, roller in ROLLERS.items():
+        start = perf_counter()
+        counts = roller.simulate(pulls)
+        elapsed = perf_counter() - start
+        print(f'{box}: {pulls} pulls in {elapsed:.2f}s '
+              f'({pulls / elapsed:,.0f} pulls/s)')
+
+        for rarity in RARITY_ORDER:
+            expected = RATES[box].get(rarity, 0)
+            simulated = counts[rarity] / pulls
+            line = f'    {rarity}: {expected:.2%} simulated {simulated:.2%}'
+            if abs(expected - simulated) > TOLERANCE:
+                line += ' MISMATCH'
+                ok = False
+            if box in published:
+                shown = published[box].get(rarity, 0)
+                line += f' published {shown:.2%}'
+                if abs(shown - expected) > 1e-9:
+                    line += ' MISMATCH'
+                    ok = False
+            print(line)
+
+    print('done' if ok else 'mismatches found')
+    return 0 if ok else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())